@@ -0,0 +1,144 @@
+import os
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+from src.common import *
+from benchmarks.cases import Case, all_cases, make_data
+import argparse
+import json
+import platform
+import sys
+import tempfile
+import time
+
+BASELINE_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "baseline.json"
+)
+
+
+def measure(case: Case, repeat):
+    run = case.run
+    if case.setup is not None:
+        run = case.setup(make_data())
+    if case.repeat is not None:
+        repeat = min(repeat, case.repeat)
+    with numpy.errstate(all="ignore"):
+        run()
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            times.append((time.perf_counter() - start) * 1000)
+    return {
+        "median_ms": float(numpy.median(times)),
+        "p95_ms": float(numpy.percentile(times, 95)),
+        "runs": repeat,
+    }
+
+
+def compare(results, baseline, threshold, min_delta):
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before = baseline[name]["median_ms"]
+        after = result["median_ms"]
+        result["baseline_ms"] = before
+        result["ratio"] = after / before if before > 0 else None
+        if after > before * threshold and after - before > min_delta:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks",
+        epilog="No baseline ships with the repository, timings depend on the "
+        "machine. Run once with --save-baseline before comparing.",
+    )
+    parser.add_argument("-k", "--filter", default="", help="only run matching cases")
+    parser.add_argument("-n", "--repeat", type=int, default=20)
+    parser.add_argument(
+        "-o", "--output", help="write the JSON report here (- for stdout)"
+    )
+    parser.add_argument(
+        "--baseline", default=BASELINE_PATH, help="JSON report to compare against"
+    )
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="store the results as the baseline, merged into the cases already in it",
+    )
+    parser.add_argument("--threshold", type=float, default=1.25)
+    parser.add_argument("--min-delta", type=float, default=0.1)
+    args = parser.parse_args()
+
+    pygame.init()
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            baseline = json.load(file)["results"]
+    elif not args.save_baseline:
+        print(
+            f"No baseline at {args.baseline}, run with --save-baseline to create one",
+            file=sys.stderr,
+        )
+
+    results = {}
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        # UserData reads and writes appdata/ relative to the working directory
+        os.chdir(workdir)
+        try:
+            for case in all_cases():
+                if args.filter not in case.name:
+                    continue
+                result = measure(case, args.repeat)
+                results[case.name] = result
+                print(
+                    f"{case.name:<28} median {result['median_ms']:>10.3f} ms"
+                    f"   p95 {result['p95_ms']:>10.3f} ms",
+                    file=sys.stderr,
+                )
+        finally:
+            os.chdir(cwd)
+
+    regressions = []
+    if not args.save_baseline:
+        regressions = compare(results, baseline, args.threshold, args.min_delta)
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "numpy": numpy.__version__,
+            "pygame": pygame.version.ver,
+            "repeat": args.repeat,
+            "threshold": args.threshold,
+        },
+        "results": results,
+        "regressions": regressions,
+    }
+    if args.output == "-":
+        print(json.dumps(report, indent=4))
+    elif args.output is not None:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=4)
+    if args.save_baseline:
+        # a filtered run only replaces the cases it measured
+        saved = dict(report, results=baseline | results, regressions=[])
+        with open(args.baseline, "w") as file:
+            json.dump(saved, file, indent=4)
+
+    for name in regressions:
+        result = results[name]
+        print(
+            f"REGRESSION: {name} {result['baseline_ms']:.3f} ms -> "
+            f"{result['median_ms']:.3f} ms ({result['ratio']:.2f}x)",
+            file=sys.stderr,
+        )
+    return 1 if len(regressions) > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,310 @@
+from src.common import *
+from src.bridge import UserData, UserExpression, UserVariable
+from src.cache import CompiledExpression
+from src.coordinator import CompiledSnapshot
+from src.derivative import SampledDerivative
+from src.render import RenderFrame
+from src.solver import solve_expression, implicit_expression, derivative_expression
+
+VIEW = (1600, 1000)
+MOUSE = (VIEW[0] * 0.6, VIEW[1] * 0.4)
+CORPUS = {
+    "polynomial": ("y = x^3 - 2*x + 1", solve_expression),
+    "trig": ("y = sin(3*x)*cos(x)", solve_expression),
+    "abs": ("y = abs(x^2 - 4)", solve_expression),
+    "multi_branch": ("x^2 + y^2 = 9", solve_expression),
+    "implicit_like": ("y^2 = x^3 - x", solve_expression),
+    "implicit": ("sin(x*y) = x - y", implicit_expression),
+}
+COMPILED: dict[tuple, dict] = {}
+
+
+class Case:
+    def __init__(self, name, run, setup=None, repeat=None):
+        self.name = name
+        self.run = run
+        self.setup = setup
+        self.repeat = repeat
+
+
+def make_data(precision=10000):
+    data = UserData()
+    data.view = pygame.Vector2(VIEW)
+    data.precision = precision
+    data.adaptive_sampling = False
+    data.tiled_sampling = False
+    for raw_string, compiler in CORPUS.values():
+        add_expression(data, raw_string, compiler)
+    return data
+
+
+def add_expression(data: UserData, raw_string, compiler=solve_expression):
+    key = (raw_string, tuple(data.vars_names))
+    if key not in COMPILED:
+        COMPILED[key] = compiler(raw_string, data.vars_names)
+    expression = UserExpression(raw_string)
+    compiled = CompiledExpression.from_json(COMPILED[key])
+    expression.generation += 1
+    expression.publish(
+        CompiledSnapshot(expression.generation, raw_string, compiled), data
+    )
+    data.expressions.append(expression)
+
+
+def compute_cases():
+    cases = []
+    for name, (raw_string, compiler) in CORPUS.items():
+        cases.append(
+            Case(
+                f"compute.{name}",
+                lambda raw_string=raw_string, compiler=compiler: compiler(
+                    raw_string, []
+                ),
+                repeat=5,
+            )
+        )
+
+    def cache_hit(data: UserData):
+        key = data.compile_cache.make_key(CORPUS["trig"][0], [])
+        data.compile_cache.put(key, data.expressions[1].compiled)
+        return lambda: data.compile_cache.get(key)
+
+    cases.append(Case("compute.cache_hit", None, cache_hit))
+    return cases
+
+
+def replot(data: UserData, stride=1):
+    # drop the kept samples so every run measures a full plot
+    for expression in data.expressions:
+        expression.sampled = (None, [], 1)
+    data.plot(stride)
+
+
+def add_dependent(data: UserData):
+    # the corpus is compiled again with the variable defined, as if it had been
+    # typed afterwards, so every function takes it as an argument
+    for expression in list(data.expressions):
+        data.remove_expression(expression)
+    data.add_variable(UserVariable("a", 1))
+    for raw_string, compiler in CORPUS.values():
+        add_expression(data, raw_string, compiler)
+    add_expression(data, "y = a*sin(x)")
+
+
+def plot_cases():
+    cases = []
+    for precision in PRECISION_STEPS:
+
+        def uniform(data: UserData, precision=precision):
+            data.precision = precision
+            return lambda: replot(data)
+
+        cases.append(Case(f"plot.uniform.{precision}", None, uniform))
+
+    def tiled(data: UserData):
+        data.tiled_sampling = True
+        return lambda: replot(data)
+
+    def adaptive(data: UserData):
+        data.adaptive_sampling = True
+        return lambda: replot(data)
+
+    def float32(data: UserData):
+        data.float32_plotting = True
+        return lambda: replot(data)
+
+    def implicit(data: UserData):
+        expression = data.expressions[-1]
+        plotx, _ = data.plot_data()
+
+        def run():
+            expression.sampled = (None, [], 1)
+            expression.plot(plotx)
+
+        return run
+
+    def progressive(data: UserData, passes):
+        data.precision = 50000
+        data.tiled_sampling = True
+
+        def run():
+            data.tile_cache.clear()
+            for expression in data.expressions:
+                expression.sampled = (None, [], 1)
+            for stride in passes(data.coarse_stride):
+                data.plot(stride)
+
+        return run
+
+    def variable_change(data: UserData):
+        add_dependent(data)
+        data.plot()
+
+        def run():
+            data.set_variable(0, data.vars_values[0] + 0.01)
+            data.plot()
+
+        return run
+
+    def refine(stride):
+        while stride > 1:
+            yield stride
+            stride = max(stride // PROGRESSIVE_FACTOR, 1)
+        yield 1
+
+    cases.append(Case("plot.tiled.10000", None, tiled))
+    cases.append(Case("plot.implicit", None, implicit))
+    cases.append(
+        Case("plot.cold.50000", None, lambda data: progressive(data, lambda _: [1]))
+    )
+    cases.append(
+        Case(
+            "plot.coarse.50000",
+            None,
+            lambda data: progressive(data, lambda stride: [stride]),
+        )
+    )
+    cases.append(
+        Case("plot.refined.50000", None, lambda data: progressive(data, refine))
+    )
+    cases.append(Case("plot.variable_change", None, variable_change))
+    cases.append(Case("plot.adaptive.10000", None, adaptive))
+    cases.append(Case("plot.float32.10000", None, float32))
+    return cases
+
+
+def draw_cases():
+    def expressions(data: UserData):
+        screen = pygame.Surface(VIEW, pygame.SRCALPHA)
+        data.plot()
+        frame = RenderFrame(data, VIEW)
+        return lambda: data.draw_expressions(screen, frame)
+
+    def grid_text(data: UserData):
+        screen = pygame.Surface(VIEW, pygame.SRCALPHA)
+        frame = RenderFrame(data, VIEW)
+
+        def run():
+            center, sx, sy, cw, wl, wt, wc = data.draw_grid(
+                screen, data.camera_crange(frame), frame
+            )
+            data.draw_text(screen, center, sx, sy, cw, wl, wt, wc, frame)
+
+        return run
+
+    def area(data: UserData):
+        screen = pygame.Surface(VIEW, pygame.SRCALPHA)
+        for expression in data.expressions[:3]:
+            expression.show_area = True
+        data.plot()
+        frame = RenderFrame(data, VIEW)
+        return lambda: data.draw_expressions(screen, frame)
+
+    def pan(data: UserData, full):
+        renderer = data.renderer
+        renderer.render(renderer.requested, RenderFrame(data, VIEW), True, 1)
+        step = pygame.Vector2(7, 0) / (data.czoom * data.unit)
+
+        def run():
+            data.move_camera(data.cpos + step, data.czoom)
+            renderer.requested += 1
+            renderer.render(renderer.requested, RenderFrame(data, VIEW), full, 1)
+
+        return run
+
+    def variable_change(data: UserData):
+        # what a slider drag costs: a coarse frame, then the settled refinements
+        renderer = data.renderer
+        add_dependent(data)
+        renderer.render(renderer.requested, RenderFrame(data, VIEW), True, 1)
+
+        def run():
+            data.set_variable(0, data.vars_values[0] + 0.01)
+            renderer.requested += 1
+            renderer.render(renderer.requested, RenderFrame(data, VIEW))
+            while renderer.stride > 1:
+                renderer.render(
+                    renderer.requested,
+                    RenderFrame(data, VIEW),
+                    True,
+                    renderer.stride // PROGRESSIVE_FACTOR,
+                )
+
+        return run
+
+    def preview(data: UserData):
+        renderer = data.renderer
+        renderer.render(renderer.requested, RenderFrame(data, VIEW), True, 1)
+        frame, camera = renderer.present()
+        data.move_camera(data.cpos, data.czoom * 1.1)
+        return lambda: data.preview(frame, camera)
+
+    return [
+        Case("draw.expressions", None, expressions),
+        Case("draw.area", None, area),
+        Case("draw.grid_text", None, grid_text),
+        Case("draw.pan_full", None, lambda data: pan(data, True)),
+        Case("draw.pan_scroll", None, lambda data: pan(data, False)),
+        Case("draw.zoom_preview", None, preview),
+        Case("draw.variable_change", None, variable_change),
+    ]
+
+
+def hover_cases():
+    def plot_index(data: UserData):
+        data.plot()
+        data.plot_index.build(data.expressions, data.view)
+        return lambda: data.plot_index.query(MOUSE)
+
+    def tangent(data: UserData):
+        expression = data.expressions[0]
+        compiled = expression.compiled
+        expression.publish_derivative(
+            derivative_expression(
+                compiled.parameter_name, compiled.solution_sources, []
+            ),
+            data,
+        )
+        mouse_coord = data.screen_to_world(MOUSE).x
+        return lambda: data.get_tangent_points(
+            expression,
+            expression.derivative_funcs[0],
+            expression.numpy_functions[0],
+            mouse_coord,
+        )
+
+    def tangent_numeric(data: UserData):
+        expression = data.expressions[0]
+        data.plot()
+        data.plot_index.build(data.expressions, data.view)
+        mouse_coord = data.screen_to_world(MOUSE).x
+        return lambda: data.get_tangent_points(
+            expression,
+            SampledDerivative(expression, 0, data),
+            expression.numpy_functions[0],
+            mouse_coord,
+        )
+
+    def tangent_sampled(data: UserData):
+        expression = data.expressions[0]
+        data.plot()
+        data.plot_index.build(data.expressions, data.view)
+        mouse_coord = data.screen_to_world(MOUSE).x
+        return lambda: data.get_tangent_points(
+            expression,
+            SampledDerivative(expression, 0, data),
+            expression.numpy_functions[0],
+            mouse_coord,
+            0,
+        )
+
+    return [
+        Case("hover.plot_index", None, plot_index),
+        Case("hover.tangent", None, tangent),
+        Case("hover.tangent_numeric", None, tangent_numeric),
+        Case("hover.tangent_sampled", None, tangent_sampled),
+    ]
+
+
+def all_cases():
+    return compute_cases() + plot_cases() + draw_cases() + hover_cases()
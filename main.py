@@ -1,12 +1,12 @@
 from src.common import *
 from src.bridge import UserData, UserExpression, PlotData
+from src.polyline import visible_runs
 import faulthandler
 import random
 
 faulthandler.enable()
 
 # UI for variables
-# draw in a concurrent thread
 
 
 class MathGraphCapolavoro2025(mili.UIApp):
@@ -30,6 +30,8 @@ class MathGraphCapolavoro2025(mili.UIApp):
         pygame.key.set_repeat(300, 80)
         self.screen = pygame.Surface((10, 10), pygame.SRCALPHA)
         self.overlay_screen = pygame.Surface((10, 10), pygame.SRCALPHA)
+        self.overlay_base = None
+        self.overlay_rects = []
         self.view_rect = pygame.Rect()
         self.dragging = False
         self.data = UserData()
@@ -65,7 +67,9 @@ class MathGraphCapolavoro2025(mili.UIApp):
         self.show_settings = False
         self.settings_rect = pygame.Rect()
         self.settings_btn_rect = pygame.Rect()
-        self.on_quit = self.data.save
+        self.on_quit = self.data.quit
+        self.profiler_surface = None
+        self.profiler_time = 0
         self.win_behavior.maximize()
 
     def slider_to_value(self, steps, svalue):
@@ -81,6 +85,10 @@ class MathGraphCapolavoro2025(mili.UIApp):
         return numpy.interp(log_value, log_steps, positions)
 
     def ui(self):
+        with self.data.profiler.span("ui"):
+            self.ui_layout()
+
+    def ui_layout(self):
         pr = self.mili.current_parent_interaction.data.rect
         pid = self.mili.current_parent_id
         if pr.w == 0:
@@ -116,10 +124,15 @@ class MathGraphCapolavoro2025(mili.UIApp):
             self.ui_settings(pid)
 
     def ui_settings(self, pid):
+        toggles = [
+            ("adaptive_sampling", True),
+            ("tiled_sampling", True),
+            ("float32_plotting", True),
+        ]
         with self.mili.begin(
-            pygame.Rect(0, 0, self.data.view.x / 2, self.scale(100)).move_to(
-                bottomleft=(self.panel_rect.w + 2, self.panel_rect.h)
-            ),
+            pygame.Rect(
+                0, 0, self.data.view.x / 2, self.scale(50) * (2 + len(toggles))
+            ).move_to(bottomleft=(self.panel_rect.w + 2, self.panel_rect.h)),
             {"ignore_grid": True, "z": 999999, "parent_id": pid},
         ) as settings_cont:
             self.settings_rect = settings_cont.data.absolute_rect
@@ -183,6 +196,35 @@ class MathGraphCapolavoro2025(mili.UIApp):
                         None,
                         {"fillx": "20"},
                     )
+            for attrname, replot in toggles:
+                self.ui_settings_toggle(attrname, ts, replot)
+
+    def ui_settings_toggle(self, attrname, ts, replot):
+        with self.mili.begin(
+            None,
+            {
+                "fillx": True,
+                "filly": True,
+                "axis": "x",
+                "default_align": "center",
+            },
+        ):
+            self.mili.text_element(
+                f"{attrname.replace('_', ' ').title()}:",
+                {"size": ts, "growx": False},
+                None,
+                {"fillx": "25"},
+            )
+            value = getattr(self.data, attrname)
+            with self.mili.element(
+                None, {"fillx": "75", "filly": True, "update_id": "cursor"}
+            ) as btn:
+                self.mili.rect(mili.style.color(mili.style.cond_value(btn, *BTNS)))
+                self.mili.text("On" if value else "Off", {"size": ts})
+                if btn.left_clicked:
+                    setattr(self.data, attrname, not value)
+                    if replot:
+                        self.data.need_to_plot = True
 
     def ui_expr_dashed_line(self):
         l1 = self.mili.hline_element(
@@ -230,7 +272,7 @@ class MathGraphCapolavoro2025(mili.UIApp):
             )
             if btn.left_clicked:
                 expression.show_derivative = not expression.show_derivative
-                if expression.show_derivative and len(expression.derivatives) <= 0:
+                if expression.show_derivative and len(expression.derivative_funcs) <= 0:
                     expression.compute_derivative(self.data)
                 self.data.need_to_plot = True
 
@@ -263,8 +305,7 @@ class MathGraphCapolavoro2025(mili.UIApp):
                 {"alpha": alpha},
             )
             if btn.left_clicked:
-                self.data.expressions.remove(expression)
-                self.data.need_to_plot = True
+                self.data.remove_expression(expression)
 
     def ui_expr_expanded(self, expression: UserExpression, h):
         self.ui_expr_dashed_line()
@@ -280,25 +321,29 @@ class MathGraphCapolavoro2025(mili.UIApp):
                 txt = "Unknown since the expression contains errors"
                 col = "red"
                 size = 14
+            elif expression.derivative_pending and len(expression.derivatives) <= 0:
+                txt = "Computing..."
+                col = "grey"
+                size = 14
             else:
                 txts = []
                 for derivative in expression.derivatives:
                     if isinstance(derivative, dict):
-                        left = sympy.sstr(derivative["left"])
-                        right = sympy.sstr(derivative["right"])
-                        par = sympy.sstr(derivative["inside"])
+                        left = derivative["left"]
+                        right = derivative["right"]
+                        par = derivative["inside"]
                         res = (
-                            f"{left} "
+                            f"{right} "
                             + "{"
                             + f"{par} >= 0"
                             + "}"
-                            + f"\n    {right} "
+                            + f"\n    {left} "
                             + "{"
                             + f"{par} < 0"
                             + "}"
                         )
                     else:
-                        res = sympy.sstr(derivative)
+                        res = derivative
                     txts.append(res)
                 txt = ",\n    ".join(txts).replace("**", "^")
             with self.mili.element(
@@ -486,15 +531,14 @@ class MathGraphCapolavoro2025(mili.UIApp):
             size = edata.data.rect.size
             view_pos = pygame.Vector2(edata.data.absolute_rect.topleft)
             self.view_rect = pygame.Rect(view_pos, size)
-            old = self.screen
-            if self.screen.size != size:
-                self.screen = pygame.Surface(size, pygame.SRCALPHA)
+            if self.overlay_screen.size != size:
                 self.overlay_screen = pygame.Surface(size, pygame.SRCALPHA)
+                self.overlay_base = None
                 self.data.need_to_plot = True
-            self.mili.image(old, {"ready": True})
             self.mili.image(self.overlay_screen, {"ready": True})
 
     def event(self, e):
+        self.data.idle.activity()
         self.panel_scroll.wheel_event(e, constrain_rect=self.panel_rect)
         for expr in self.data.expressions:
             expr.entry.event(e)
@@ -521,8 +565,7 @@ class MathGraphCapolavoro2025(mili.UIApp):
                 rel = pygame.Vector2(e.rel)
                 rel /= self.data.unit * self.data.czoom
                 rel.y *= -1
-                self.data.cpos -= rel
-                self.data.need_to_plot = True
+                self.data.move_camera(self.data.cpos - rel, self.data.czoom)
                 self.dragging = True
         if e.type == pygame.MOUSEWHEEL and in_rect:
             mpos = mpos - self.view_rect.topleft
@@ -530,8 +573,7 @@ class MathGraphCapolavoro2025(mili.UIApp):
             self.data.czoom += (e.y * self.data.czoom) * 0.1
             self.data.czoom = pygame.math.clamp(self.data.czoom, 0.000000001, 100000000)
             new = self.data.screen_to_world(mpos)
-            self.data.cpos -= new - prev
-            self.data.need_to_plot = True
+            self.data.move_camera(self.data.cpos - (new - prev), self.data.czoom)
         if e.type == pygame.KEYDOWN:
             if e.mod & pygame.KMOD_CTRL:
                 if e.key == pygame.K_s:
@@ -540,74 +582,126 @@ class MathGraphCapolavoro2025(mili.UIApp):
                     self.show_settings = not self.show_settings
                 if e.key == pygame.K_r:
                     self.data.reset_cam()
+                if e.key == pygame.K_p:
+                    self.data.animation.toggle()
+                if e.key == pygame.K_d:
+                    self.data.profiler.overlay = not self.data.profiler.overlay
+                if e.key == pygame.K_t:
+                    self.data.profiler.record()
 
     def update(self):
+        self.data.idle.wait()
+        self.data.profiler.frame()
         new_fs = self.scale(FONT_SIZE)
         self.data.font_pad = self.scale(FONT_SIZE / 5)
         if new_fs != self.data.font_size:
             self.data.font_size = new_fs
             self.data.font = pygame.font.SysFont("Segoe UI", new_fs)
+            self.data.text_cache.clear()
         self.style["target_framerate"] = self.data.framerate
-        self.window.title = f"Math Graph ({round(self.clock.get_fps())} FPS)"
-        self.data.update(self.screen)
-        self.overlay_screen.fill(0)
+        self.window.title = (
+            f"Math Graph ({round(self.clock.get_fps())} FPS, "
+            f"{self.data.idle.idle_ratio:.0%} idle)"
+        )
+        self.data.animation.update()
+        self.screen = self.data.update(self.overlay_screen.size)
+        self.clear_overlay()
         mvec = pygame.Vector2(pygame.mouse.get_pos()) - self.view_rect.topleft
         world_mouse = self.data.screen_to_world(mvec)
+        hover_key = self.data.hover_key(mvec)
         if not self.dragging:
-            try:
-                if self.update_closest_point(mvec):
-                    self.update_closest_point_backup(mvec, world_mouse)
-            except Exception:
-                ...
-        for expression in self.data.expressions:
-            if expression.should_skip_derivative:
-                continue
-            self.update_derivative(expression, world_mouse)
-        self.overlay_screen.blit(
-            self.data.font.render(
-                f"Mouse: {self.data.format_number(world_mouse[0])} X, {self.data.format_number(world_mouse[1])} Y",
-                True,
-                AXIS_COL,
-            ),
-            (self.data.font_pad, self.data.font_pad),
+            with self.data.profiler.span("update_closest_point"):
+                try:
+                    self.update_closest_point(mvec, world_mouse, hover_key)
+                except Exception:
+                    ...
+        with self.data.profiler.span("update_derivative"):
+            for expression in self.data.expressions:
+                if expression.should_skip_derivative:
+                    continue
+                self.update_derivative(expression, world_mouse, hover_key)
+        mouse_surf = self.data.render_text(
+            f"Mouse: {self.data.format_number(world_mouse[0])} X, {self.data.format_number(world_mouse[1])} Y",
+            AXIS_COL,
         )
+        self.overlay_blit(mouse_surf, (self.data.font_pad, self.data.font_pad))
+        if self.data.profiler.overlay:
+            self.update_profiler(mouse_surf.height + self.data.font_pad * 2)
 
-    def update_derivative(self, expr: UserExpression, world_mouse):
+    def clear_overlay(self):
+        # the overlay is composited over the frame, so only what it covered is restored
+        if self.data.frame_key != self.overlay_base:
+            self.overlay_base = self.data.frame_key
+            self.overlay_rects = [self.overlay_screen.get_rect()]
+        for rect in self.overlay_rects:
+            rect = rect.inflate(2, 2).clip(self.overlay_screen.get_rect())
+            self.overlay_screen.fill(0, rect)
+            self.overlay_screen.blit(self.screen, rect, rect, pygame.BLEND_RGBA_ADD)
+        self.overlay_rects = []
+
+    def overlay_blit(self, surface, dest):
+        self.overlay_rects.append(self.overlay_screen.blit(surface, dest))
+
+    def update_profiler(self, top):
+        now = pygame.time.get_ticks()
+        if (
+            self.profiler_surface is None
+            or now - self.profiler_time >= PROFILER_OVERLAY_REFRESH
+        ):
+            profiler = self.data.profiler
+            phases, net_blocks = profiler.summary()
+            lines = [
+                f"{name}: {mean:.2f} ms (max {peak:.2f})"
+                for name, (mean, peak) in sorted(phases.items())
+            ]
+            lines.append(f"Net blocks/frame: {net_blocks:+.0f}")
+            lines.append(
+                f"Cache hits: compile {self.data.compile_cache.hit_rate:.0%}, "
+                f"tiles {self.data.tile_cache.hit_rate:.0%}, "
+                f"text {self.data.text_cache.hit_rate:.0%}"
+            )
+            if profiler.recording:
+                lines.append("Recording trace...")
+            self.profiler_surface = self.data.text_cache.render_uncached(
+                self.data.font, "\n".join(lines), AXIS_COL
+            )
+            self.profiler_time = now
+        self.overlay_blit(self.profiler_surface, (self.data.font_pad, top))
+
+    def update_derivative(self, expr: UserExpression, world_mouse, hover_key):
         mouse_coord = world_mouse.x
         if expr.kind == "y":
             mouse_coord = world_mouse.y
         for i, derivative_func in enumerate(expr.derivative_funcs):
-            if isinstance(derivative_func, dict):
-                yvalue = derivative_func["inside"](mouse_coord, *self.data.vars_values)
-                if yvalue >= 0:
-                    dfunc = derivative_func["right"]
-                else:
-                    dfunc = derivative_func["left"]
-            else:
-                dfunc = derivative_func
             try:
-                points, tangent_point, slope, y0 = self.data.get_tangent_points(
-                    expr, dfunc, expr.numpy_functions[i], mouse_coord
+                points, tangent_point, slope, y0 = self.data.hover_cache.lookup(
+                    hover_key,
+                    (expr, i),
+                    lambda i=i, f=derivative_func: self.data.get_tangent_points(
+                        expr,
+                        f,
+                        expr.numpy_functions[i],
+                        mouse_coord,
+                        i,
+                    ),
+                    derivative_func,
                 )
             except Exception:
                 return
             if points is None:
                 return
-            pygame.draw.aaline(
-                self.overlay_screen,
-                expr.color,
-                self.clamp_view(points[0]),
-                self.clamp_view(points[1]),
-            )
+            for run in visible_runs(points, self.data.view):
+                self.overlay_rects.append(
+                    pygame.draw.aalines(self.overlay_screen, expr.color, False, run)
+                )
             name = "y0"
             if expr.kind == "y":
                 name = "x0"
-            tsurf = self.data.font.render(
+            tsurf = self.data.render_text(
                 f"m: {self.data.format_number(slope)}\n{name}: {self.data.format_number(y0)}",
-                True,
                 expr.color,
             )
-            self.overlay_screen.blit(
+            self.overlay_blit(
                 tsurf,
                 tsurf.get_rect(
                     midbottom=(
@@ -625,77 +719,31 @@ class MathGraphCapolavoro2025(mili.UIApp):
                 ),
             )
 
-    def clamp_view(self, point):
-        ra, rb = -1e20, 1e20
-        return (
-            pygame.math.clamp(point[0], ra, rb),
-            pygame.math.clamp(point[1], ra, rb),
+    def update_closest_point(self, mvec, world_mouse, hover_key):
+        hit = self.data.hover_cache.lookup(
+            hover_key, "closest", lambda: self.find_closest_point(mvec, world_mouse)
         )
-
-    def update_closest_point_backup(self, mvec, world_mouse):
-        closest = None
-        col = None
-        for expression in self.data.expressions:
-            if expression.should_skip:
-                continue
-            for func in expression.numpy_functions:
-                with numpy.errstate(divide="ignore", invalid="ignore"):
-                    y = func(world_mouse.x, *self.data.vars_values)
-                if numpy.isnan(y) or numpy.isinf(y):
-                    continue
-                wpoint = (world_mouse.x, y)
-                spoint = self.data.world_to_screen(wpoint)
-                dist = (spoint - mvec).magnitude()
-                if dist > HOVER_MAX_DIST:
-                    continue
-                if closest is None:
-                    closest = spoint
-                    col = expression.color
-                else:
-                    if dist < (closest - mvec).magnitude():
-                        closest = spoint
-                        col = expression.color
-        if closest is not None:
-            pygame.draw.aacircle(self.overlay_screen, col, closest, 3)
-            self.render_closest(closest, col)
-            return False
-        return True
-
-    def update_closest_point(self, mvec):
-        closest = None
-        mouse = numpy.fromiter(mvec, numpy.float32)
-        col = None
-        for expression in reversed(self.data.expressions):
-            if expression.should_skip:
-                continue
-            for plot in expression.plots:
-                cpoint = self.data.get_closest_point(plot, mouse)
-                if cpoint is None:
-                    continue
-                cpoint = pygame.Vector2(cpoint[0], cpoint[1])
-                dist = (cpoint - mvec).magnitude()
-                if dist > HOVER_MAX_DIST:
-                    continue
-                if closest is None:
-                    closest = cpoint
-                    col = expression.color
-                else:
-                    if dist < (closest - mvec).magnitude():
-                        closest = cpoint
-                        col = expression.color
-        if closest is not None:
+        if hit is None:
+            return
+        closest, col = hit
+        self.overlay_rects.append(
             pygame.draw.aacircle(self.overlay_screen, col, closest, 3)
-            self.render_closest(closest, col)
-            return False
-        return True
+        )
+        self.render_closest(closest, col)
+
+    def find_closest_point(self, mvec, world_mouse):
+        hit = self.data.plot_index.query(mvec, HOVER_MAX_DIST)
+        if hit is None:
+            return self.data.get_closest_value(mvec, world_mouse)
+        point, expression, _ = hit
+        return pygame.Vector2(point[0], point[1]), expression.color
 
     def render_closest(self, closest, col):
-        tsurf = self.data.font.render(
+        tsurf = self.data.render_text(
             f"({self.data.format_number(closest[0])}, {self.data.format_number(closest[1])})",
-            True,
             col,
         )
-        self.overlay_screen.blit(
+        self.overlay_blit(
             tsurf,
             tsurf.get_rect(
                 midbottom=(
@@ -0,0 +1,261 @@
+from .common import *
+from .sampling import evaluate
+from .implicit import implicit_contour
+import copy
+import threading
+
+if typing.TYPE_CHECKING:
+    from .bridge import PlotData, UserData, UserExpression
+    from .render import RenderFrame
+
+
+class VariableAnimation:
+    def __init__(self, data: "UserData"):
+        self.data = data
+        self.index = None
+        self.original = None
+        self.playing = False
+        self.start_time = 0
+        self.values = numpy.empty(0)
+        self.frame = -1
+        self.position = 0
+        self.frames: dict[int, dict["UserExpression", tuple[list, list]]] = {}
+        self.sizes: dict[int, int] = {}
+        self.bytes = 0
+        self.key = None
+        self.plotx: "PlotData" = None
+        self.ploty: "PlotData" = None
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.running = False
+
+    @property
+    def frame_count(self):
+        return len(self.values)
+
+    def play(self, index):
+        variable = self.data.variables[index]
+        if variable.vrange is not None:
+            low, high = variable.vrange
+        else:
+            low, high = (
+                variable.value - ANIMATION_RANGE,
+                variable.value + ANIMATION_RANGE,
+            )
+        count = max(int(ANIMATION_SECONDS * self.data.framerate), 2)
+        with self.lock:
+            self.values = numpy.linspace(low, high, count)
+            self.index = index
+            self.original = variable.value
+            self.frame = -1
+            self.key = None
+            self.frames.clear()
+            self.sizes.clear()
+            self.bytes = 0
+            self.playing = True
+            if not self.running:
+                self.running = True
+                self.thread = threading.Thread(
+                    target=self.run, name="animation", daemon=True
+                )
+                self.thread.start()
+        self.start_time = pygame.time.get_ticks()
+
+    def stop(self):
+        with self.lock:
+            self.playing = False
+            self.frames.clear()
+            self.sizes.clear()
+            self.bytes = 0
+        # the sweep is a preview, the variable keeps the value it had before
+        if self.index < len(self.data.variables):
+            self.data.set_variable(self.index, self.original)
+        self.data.need_to_plot = True
+
+    def toggle(self, index=0):
+        if self.playing:
+            self.stop()
+        elif index < len(self.data.variables):
+            self.play(index)
+
+    def frame_at(self, position):
+        period = 2 * (self.frame_count - 1)
+        position %= period
+        if position < self.frame_count:
+            return position
+        return period - position
+
+    def make_key(self, frame: "RenderFrame" = None):
+        data = self.data if frame is None else frame
+        return (
+            self.index,
+            tuple(data.cpos),
+            data.czoom,
+            data.unit,
+            tuple(data.view),
+            data.precision,
+            tuple(value for i, value in enumerate(data.vars_values) if i != self.index),
+            tuple(
+                (expression, expression.snapshot.generation, expression.show_area)
+                for expression in data.expressions
+            ),
+        )
+
+    def update(self):
+        if not self.playing:
+            return
+        elapsed = pygame.time.get_ticks() - self.start_time
+        position = int(elapsed * self.data.framerate / 1000)
+        frame = self.frame_at(position)
+        if frame == self.frame:
+            return
+        key = self.make_key()
+        with self.lock:
+            if key != self.key:
+                self.key = key
+                self.frames.clear()
+                self.sizes.clear()
+                self.bytes = 0
+                self.plotx, self.ploty = self.data.plot_data()
+            self.frame = frame
+            self.position = position
+        self.data.set_variable(self.index, float(self.values[frame]))
+        self.data.need_to_plot = True
+        self.wakeup.set()
+
+    def apply(self, frame: "RenderFrame" = None):
+        if not self.playing:
+            return False
+        key = self.make_key(frame)
+        with self.lock:
+            if key != self.key:
+                return False
+            frame = self.frames.get(self.frame)
+        if frame is None:
+            return False
+        for expression, (plots, area_plots) in frame.items():
+            expression.plots = plots
+            expression.area_plots = area_plots
+            expression.sampled = (None, [], 1)
+            expression.stride = 1
+        return True
+
+    def missing_frames(self):
+        ahead = []
+        for offset in range(min(ANIMATION_LOOKAHEAD, 2 * (self.frame_count - 1))):
+            frame = self.frame_at(self.position + offset)
+            if frame not in ahead:
+                ahead.append(frame)
+        for frame in list(self.frames):
+            if self.bytes <= ANIMATION_BUFFER_BYTES:
+                break
+            if frame not in ahead:
+                self.frames.pop(frame)
+                self.bytes -= self.sizes.pop(frame)
+        if self.bytes > ANIMATION_BUFFER_BYTES:
+            return []
+        missing = [frame for frame in ahead if frame not in self.frames]
+        return missing[:ANIMATION_BLOCK]
+
+    def run(self):
+        while self.running:
+            self.wakeup.wait()
+            self.wakeup.clear()
+            while self.running and self.playing:
+                with self.lock:
+                    key = self.key
+                    plotx, ploty = self.plotx, self.ploty
+                    frames = self.missing_frames() if key is not None else []
+                if len(frames) <= 0:
+                    break
+                with self.data.profiler.span("animation_block"):
+                    block, size = self.render_block(plotx, ploty, frames)
+                with self.lock:
+                    if key != self.key:
+                        continue
+                    for frame, result in zip(frames, block):
+                        self.frames[frame] = result
+                        self.sizes[frame] = size // len(frames)
+                        self.bytes += size // len(frames)
+                    if self.frame in frames:
+                        self.data.need_to_plot = True
+
+    def render_block(self, plotx: "PlotData", ploty: "PlotData", frames):
+        values = self.values[frames]
+        block = [{} for _ in frames]
+        size = 0
+        for expression in list(self.data.expressions):
+            snapshot = expression.snapshot
+            data = (ploty if snapshot.kind == "y" else plotx).bind(snapshot.variables)
+            results = [([], []) for _ in frames]
+            if not expression.error and data.step != 0:
+                with numpy.errstate(divide="ignore", invalid="ignore"):
+                    try:
+                        results, used = self.sweep(expression, data, values)
+                        size += used
+                    except Exception as e:
+                        print(f"ERROR: {e}")
+            for frame, result in zip(block, results):
+                frame[expression] = result
+        return block, size
+
+    def sweep(self, expression: "UserExpression", data: "PlotData", values):
+        snapshot = expression.snapshot
+        name = self.data.vars_names[self.index]
+        if name not in snapshot.dependencies or name not in snapshot.variables:
+            # the curve ignores the animated variable, every frame shares one plot
+            results, size = self.sweep_values(expression, data, values[:1], None)
+            return results * len(values), size
+        return self.sweep_values(
+            expression, data, values, snapshot.variables.index(name)
+        )
+
+    def sweep_values(
+        self, expression: "UserExpression", data: "PlotData", values, index
+    ):
+        snapshot = expression.snapshot
+        plots = [[] for _ in values]
+        size = 0
+        if snapshot.kind == "implicit":
+            for i, value in enumerate(values):
+                frame_data = copy.copy(data)
+                frame_data.variables = list(data.variables)
+                if index is not None:
+                    frame_data.variables[index] = value
+                for function in snapshot.numpy_functions:
+                    plots[i].extend(implicit_contour(function, frame_data))
+            size = sum(points.nbytes for frame in plots for points in frame)
+            return [expression.shape_plots(frame, data) for frame in plots], size
+
+        # one broadcast call evaluates every frame of the block: values x samples
+        xs = numpy.arange(data.start, data.stop, data.step, dtype=data.dtype)
+        variables = list(data.variables)
+        if index is not None:
+            variables[index] = values[:, None]
+        scale = data.czoom * data.unit
+        axis = (xs - data.cposx) * scale + data.viewx / 2
+        value_axis, offset, sign = 1, data.cposy, -1
+        if snapshot.kind == "y":
+            axis = -(xs - data.cposy) * scale + data.viewy / 2
+            value_axis, offset, sign = 0, data.cposx, 1
+        for function in snapshot.numpy_functions:
+            ys = evaluate(function, xs, variables)
+            ys = numpy.broadcast_to(ys, (len(values), len(xs)))
+            points = numpy.empty((len(values), len(xs), 2), data.dtype)
+            points[:, :, 1 - value_axis] = axis
+            screen = points[:, :, value_axis]
+            numpy.subtract(ys, offset, out=screen)
+            screen *= sign * scale
+            screen += (data.viewy if value_axis == 1 else data.viewx) / 2
+            size += points.nbytes
+            for i in range(len(values)):
+                plots[i].append(points[i])
+        return [expression.shape_plots(frame, data) for frame in plots], size
+
+    def shutdown(self):
+        if self.playing:
+            self.stop()
+        self.running = False
+        self.playing = False
+        self.wakeup.set()
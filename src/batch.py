@@ -0,0 +1,163 @@
+from .common import *
+from .sampling import evaluate
+
+if typing.TYPE_CHECKING:
+    from .bridge import PlotData, UserExpression
+
+
+class PlotBuffer:
+    def __init__(self):
+        self.dtype = numpy.float64
+        self.points = numpy.empty((0, 0, 0, 2))
+        self.steps = numpy.empty(0)
+        self.x_axis = numpy.empty(0)
+        self.y_axis = numpy.empty(0)
+        self.x_screen = numpy.empty(0)
+        self.y_screen = numpy.empty(0)
+        self.pool: dict[tuple, numpy.ndarray] = {}
+
+    def set_dtype(self, dtype):
+        if dtype == self.dtype:
+            return
+        self.dtype = dtype
+        self.points = numpy.empty((0, 0, 0, 2), dtype)
+        self.steps = numpy.empty(0, dtype)
+        self.pool.clear()
+
+    def reserve(self, expressions, branches, samples):
+        current_e, current_b, current_s, _ = self.points.shape
+        if expressions > current_e or branches > current_b or samples > current_s:
+            self.points = numpy.empty(
+                (
+                    max(expressions, current_e),
+                    max(branches, current_b),
+                    max(samples, current_s),
+                    2,
+                ),
+                self.dtype,
+            )
+        if samples > len(self.steps):
+            self.steps = numpy.arange(samples, dtype=self.dtype)
+            self.x_axis = numpy.empty(samples, self.dtype)
+            self.y_axis = numpy.empty(samples, self.dtype)
+            self.x_screen = numpy.empty(samples, self.dtype)
+            self.y_screen = numpy.empty(samples, self.dtype)
+
+    def acquire(self, key, count):
+        # grows geometrically so panning does not reallocate on every small change
+        array = self.pool.get(key)
+        if array is None or len(array) < count:
+            array = numpy.empty((max(count, 1) * 3 // 2, 2), self.dtype)
+            self.pool[key] = array
+        return array[:count]
+
+    def count(self, data: "PlotData"):
+        if data.step == 0:
+            return 0
+        return max(int(numpy.ceil((data.stop - data.start) / data.step)), 0)
+
+    def build_axis(self, data: "PlotData", count, axis, screen, screen_axis):
+        numpy.multiply(self.steps[:count], data.step, out=axis[:count])
+        axis[:count] += data.start
+        scale = data.czoom * data.unit
+        if screen_axis == 0:
+            numpy.subtract(axis[:count], data.cposx, out=screen[:count])
+            screen[:count] *= scale
+            screen[:count] += data.viewx / 2
+        else:
+            numpy.subtract(axis[:count], data.cposy, out=screen[:count])
+            screen[:count] *= -scale
+            screen[:count] += data.viewy / 2
+
+    def plot(
+        self, expressions: list["UserExpression"], plotx: "PlotData", ploty: "PlotData"
+    ):
+        self.set_dtype(plotx.dtype)
+        if plotx.adaptive or plotx.tiles is not None:
+            for slot, expression in enumerate(expressions):
+                expression.plot(ploty if expression.kind == "y" else plotx, self, slot)
+            return
+        countx = self.count(plotx)
+        county = self.count(ploty)
+        self.reserve(
+            len(expressions),
+            max([len(expr.snapshot.numpy_functions) for expr in expressions] + [1]),
+            max(countx, county),
+        )
+        self.build_axis(plotx, countx, self.x_axis, self.x_screen, 0)
+        self.build_axis(ploty, county, self.y_axis, self.y_screen, 1)
+        for slot, expression in enumerate(expressions):
+            snapshot = expression.snapshot
+            if snapshot.kind == "implicit":
+                expression.plot(plotx)
+                continue
+            if snapshot.kind == "y":
+                data, count, axis, screen = ploty, county, self.y_axis, self.y_screen
+            else:
+                data, count, axis, screen = plotx, countx, self.x_axis, self.x_screen
+            data = data.bind(snapshot.variables)
+            key = expression.plot_key(data, slot)
+            if expression.reuse_plots(key, data):
+                continue
+            expression.plots = []
+            expression.area_plots = []
+            expression.sampled = (None, [], 1)
+            expression.stride = data.stride
+            if expression.error or count <= 0:
+                continue
+            if not self.plot_expression(slot, expression, data, axis[:count], screen):
+                continue
+            expression.sampled = (key, list(expression.plots), expression.stride)
+            expression.finish_plots(data)
+
+    def plot_expression(self, slot, expression: "UserExpression", data, axis, screen):
+        count = len(axis)
+        snapshot = expression.snapshot
+        for b, function in enumerate(snapshot.numpy_functions):
+            out = self.points[slot, b, :count]
+            with numpy.errstate(divide="ignore", invalid="ignore"):
+                try:
+                    values = evaluate(function, axis, data.variables)
+                except (TypeError, NameError):
+                    expression.plot_error_reason = (
+                        "Expression uses undefined variables!"
+                    )
+                    print(f"ERROR: {expression.plot_error_reason}")
+                    expression.plots = []
+                    return False
+                try:
+                    if snapshot.kind == "y":
+                        out[:, 1] = screen[:count]
+                        self.to_screen(values, data, out[:, 0], 0)
+                    else:
+                        out[:, 0] = screen[:count]
+                        self.to_screen(values, data, out[:, 1], 1)
+                except Exception as e:
+                    expression.plot_error_reason = str(e)
+                    print(f"ERROR: {expression.plot_error_reason}")
+                    expression.plots = []
+                    return False
+            expression.plots.append(out)
+        return True
+
+    def to_screen(self, values, data: "PlotData", out, screen_axis):
+        scale = data.czoom * data.unit
+        if screen_axis == 0:
+            numpy.subtract(values, data.cposx, out=out)
+            out *= scale
+            out += data.viewx / 2
+        else:
+            numpy.subtract(values, data.cposy, out=out)
+            out *= -scale
+            out += data.viewy / 2
+        return out
+
+    def store(self, slot, branch, kind, xs, ys, data: "PlotData"):
+        points = self.acquire((slot, branch, "points"), len(xs))
+        if kind == "y":
+            self.to_screen(ys, data, points[:, 0], 0)
+            self.to_screen(xs, data, points[:, 1], 1)
+        else:
+            self.to_screen(xs, data, points[:, 0], 0)
+            self.to_screen(ys, data, points[:, 1], 1)
+        return points
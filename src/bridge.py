@@ -1,10 +1,34 @@
 from .common import *
-import sympy
+from .cache import CompileCache, CompiledExpression, build_numpy_function
+from .solver import SolverPool
+from .coordinator import ComputeCoordinator, CompiledSnapshot
+from .sampling import EvaluationBudget, adaptive_sample, evaluate
+from .tiles import TileCache
+from .polyline import axis_span, decimate_columns, visible_runs
+from .spatial import HoverCache, PlotIndex
+from .batch import PlotBuffer
+from .layers import TextCache, GridLayer, AreaLayer
+from .render import RenderFrame, RenderWorker
+from .implicit import implicit_contour
+from .animation import VariableAnimation
+from .profiler import Profiler
+from .idle import IdleScheduler
+from .derivative import SampledDerivative
+import copy
+import itertools
 import os
 import json
 import threading
 
 
+def bind_variables(names, values, wanted):
+    # compiled functions take the variables they were compiled with, matched by name
+    if tuple(names) == tuple(wanted):
+        return list(values)
+    lookup = dict(zip(names, values))
+    return [lookup.get(name, numpy.nan) for name in wanted]
+
+
 class UserVariable:
     def __init__(self, name="", value=0, vrange=None):
         self.name = name
@@ -21,7 +45,23 @@ class UserVariable:
 
 
 class PlotData:
-    def __init__(self, start, stop, step, variables, cpos, czoom, unit, view):
+    def __init__(
+        self,
+        start,
+        stop,
+        step,
+        variables,
+        cpos,
+        czoom,
+        unit,
+        view,
+        adaptive=False,
+        budget: EvaluationBudget = None,
+        tiles: TileCache = None,
+        dtype=numpy.float64,
+        stride=1,
+        names=(),
+    ):
         self.start = start
         self.stop = stop
         self.step = step
@@ -32,6 +72,20 @@ class PlotData:
         self.unit = unit
         self.view = view
         self.viewx, self.viewy = view
+        self.adaptive = adaptive
+        self.budget = budget
+        self.tiles = tiles
+        self.dtype = dtype
+        self.stride = stride
+        self.names = names
+
+    def bind(self, names):
+        if tuple(names) == tuple(self.names):
+            return self
+        data = copy.copy(self)
+        data.variables = bind_variables(self.names, self.variables, names)
+        data.names = names
+        return data
 
 
 class UserExpression:
@@ -41,11 +95,11 @@ class UserExpression:
         self.raw_temporary = raw_string
         self.editing = False
         self.edit_start_time = 0
-        self.error = False
-        self.error_reason = None
+        self.speculated = False
+        self.plot_error_reason = None
         self.plots = []
-        self.kind = "x"
-        self.computing = False
+        self.generation = 0
+        self.snapshot = CompiledSnapshot()
         self.collapsed = True
         self.hidden = False
         self.show_derivative = False
@@ -55,13 +109,46 @@ class UserExpression:
         self.derivative_error = False
         self.derivative_error_reason = False
         self.derivative_funcs = []
-        self.numpy_functions = []
-        self.solutions = []
-        self.parameter = None
+        self.derivative_pending = False
+        self.plot_data: PlotData = None
+        self.sampled = (None, [], 1)
+        self.stride = 1
         self.entry = mili.EntryLine(
             self.raw_string, ENTRY_STYLE | {"placeholder": "Enter expression..."}
         )
 
+    @property
+    def compiled(self) -> CompiledExpression:
+        return self.snapshot.compiled
+
+    @property
+    def kind(self):
+        return self.snapshot.kind
+
+    @property
+    def numpy_functions(self):
+        return self.snapshot.numpy_functions
+
+    @property
+    def error(self):
+        return self.snapshot.error or self.plot_error_reason is not None
+
+    @property
+    def error_reason(self):
+        if self.plot_error_reason is not None:
+            return self.plot_error_reason
+        return self.snapshot.error_reason
+
+    @property
+    def computing(self):
+        return self.generation != self.snapshot.generation
+
+    @property
+    def parameter(self):
+        if self.compiled is None:
+            return None
+        return self.compiled.parameter
+
     @property
     def should_skip(self):
         return self.error or self.hidden
@@ -74,246 +161,278 @@ class UserExpression:
         if self.raw_temporary != new_raw:
             self.edit_start_time = pygame.time.get_ticks()
             self.editing = True
+            self.speculated = False
         self.raw_temporary = new_raw
 
     def check_edit(self, data: "UserData"):
-        if self.computing:
+        if not self.editing:
             return
-        if self.editing and pygame.time.get_ticks() - self.edit_start_time >= 500:
+        elapsed = pygame.time.get_ticks() - self.edit_start_time
+        if elapsed >= 500:
             self.raw_string = self.raw_temporary
             self.editing = False
             self.send_compute(data)
-
-    def send_compute(self, data):
-        self.computing = True
-        thread = threading.Thread(target=self.compute, args=(data,))
-        thread.start()
+        elif elapsed >= SPECULATIVE_DELAY and not self.speculated:
+            self.speculated = True
+            data.coordinator.request(self, self.raw_temporary, speculative=True)
+
+    def cancel_compute(self, data: "UserData"):
+        data.coordinator.cancel(self)
+
+    def send_compute(self, data: "UserData"):
+        data.coordinator.request(self)
+
+    def publish(self, snapshot: CompiledSnapshot, data: "UserData"):
+        data.tile_cache.discard(self.snapshot.numpy_functions)
+        data.track(self, self.snapshot.dependencies, snapshot.dependencies)
+        self.snapshot = snapshot
+        self.plot_error_reason = None
+        if snapshot.error:
+            print(f"ERROR: {snapshot.error_reason}")
+        self.derivatives = []
+        self.derivative_funcs = []
+        if self.show_derivative:
+            self.compute_derivative(data)
+        data.need_to_plot = True
 
     def world_to_screen(self, xs, ys, plot: PlotData):
         sx = (xs - plot.cposx) * plot.czoom * plot.unit + plot.viewx / 2
         sy = -(ys - plot.cposy) * plot.czoom * plot.unit + plot.viewy / 2
         return sx, sy
 
-    def plot(self, data: PlotData):
+    def arguments(self, data: "UserData"):
+        return bind_variables(
+            data.vars_names, data.vars_values, self.snapshot.variables
+        )
+
+    def inputs(self, data: PlotData):
+        # functions take every variable defined when they were compiled, only
+        # the ones the expression mentions change its samples
+        dependencies = self.snapshot.dependencies
+        return tuple(
+            value
+            for name, value in zip(data.names, data.variables)
+            if name in dependencies
+        )
+
+    def plot_key(self, data: PlotData, slot):
+        # everything the samples depend on, so changes elsewhere leave them alone
+        key = (
+            self.snapshot.numpy_functions,
+            self.inputs(data),
+            data.cposx,
+            data.cposy,
+            data.czoom,
+            data.unit,
+            data.viewx,
+            data.viewy,
+            data.dtype,
+        )
+        if self.kind == "implicit":
+            # contours do not depend on the sample stride, refinement passes reuse them
+            return key
+        step = data.step
+        if data.tiles is None:
+            # untiled passes fold their stride into the step
+            step /= data.stride
+        return key + (
+            data.start,
+            data.stop,
+            step,
+            data.adaptive,
+            data.tiles is not None,
+            slot,
+        )
+
+    def reuse_plots(self, key, data: PlotData):
+        # samples at least as fine as the pass asks for are kept, so only the
+        # expressions whose inputs changed go through the coarse passes again
+        if self.sampled[0] != key or self.sampled[2] > data.stride:
+            return False
+        self.plots = list(self.sampled[1])
+        self.stride = self.sampled[2]
+        self.finish_plots(data)
+        return True
+
+    def plot(self, data: PlotData, buffer: PlotBuffer = None, slot=0):
+        data = data.bind(self.snapshot.variables)
+        key = self.plot_key(data, slot)
+        if self.reuse_plots(key, data):
+            return
         self.plots = []
         self.area_plots = []
+        self.sampled = (None, [], 1)
+        self.stride = 1
+        snapshot = self.snapshot
         if self.error:
             return
         if data.step == 0:
             return
-        xs = numpy.arange(data.start, data.stop, data.step)
-        for function in self.numpy_functions:
+        if not data.adaptive and data.tiles is None:
+            xs = numpy.arange(data.start, data.stop, data.step, dtype=data.dtype)
+            if snapshot.kind != "implicit":
+                self.stride = data.stride
+        for branch, function in enumerate(snapshot.numpy_functions):
             with numpy.errstate(divide="ignore", invalid="ignore"):
                 try:
-                    ys = function(xs, *data.variables)
-                    if numpy.isscalar(ys):
-                        ys = numpy.full_like(xs, ys)
+                    if snapshot.kind == "implicit":
+                        self.plots.extend(implicit_contour(function, data))
+                        continue
+                    if data.adaptive:
+                        xs, ys = self.sample_adaptive(function, snapshot.kind, data)
+                    elif data.tiles is not None:
+                        xs, ys, stride = data.tiles.sample(
+                            function,
+                            data,
+                            data.viewy if snapshot.kind == "y" else data.viewx,
+                            self.inputs(data),
+                        )
+                        self.stride = max(self.stride, stride)
+                    else:
+                        ys = evaluate(function, xs, data.variables)
                 except (TypeError, NameError):
-                    self.error = True
-                    self.error_reason = "Expression uses undefined variables!"
-                    print(f"ERROR: {self.error_reason}")
+                    self.plot_error_reason = "Expression uses undefined variables!"
+                    print(f"ERROR: {self.plot_error_reason}")
                     self.plots = []
                     return
-            rs, re = xs, ys
-            if self.kind == "y":
-                (
-                    rs,
-                    re,
-                ) = ys, xs
             try:
-                rs, re = self.world_to_screen(rs, re, data)
-                points = numpy.column_stack((rs, re))
+                if buffer is not None:
+                    points = buffer.store(slot, branch, snapshot.kind, xs, ys, data)
+                else:
+                    rs, re = xs, ys
+                    if snapshot.kind == "y":
+                        (
+                            rs,
+                            re,
+                        ) = ys, xs
+                    rs, re = self.world_to_screen(rs, re, data)
+                    points = numpy.column_stack((rs, re))
             except Exception as e:
-                self.error = True
-                self.error_reason = str(e)
-                print(f"ERROR: {self.error_reason}")
+                self.plot_error_reason = str(e)
+                print(f"ERROR: {self.plot_error_reason}")
                 self.plots = []
                 return
             self.plots.append(points)
-            if self.show_area:
-                clamped = numpy.copy(points)
-                clamped = clamped[~numpy.isnan(clamped).any(axis=1)]
-                clamped[:, 1] = numpy.clip(clamped[:, 1], 0, data.view.y)
-                self.area_plots.append(clamped)
-        if len(self.plots) > 1 and not self.show_area:
-            new_plots = []
-            for i, plot in enumerate(self.plots):
-                inside_mask = (
-                    (plot[:, 0] >= 0)
-                    & (plot[:, 0] <= data.view.x)
-                    & (plot[:, 1] >= 0)
-                    & (plot[:, 1] <= data.view.y)
-                )
-                inside_points = plot[inside_mask]
-                new_plots.append(inside_points)
-            self.plots = new_plots
-
-    def compute(self, data: "UserData"):
-        self.error = False
-        self.error_reason = None
-        self.numpy_functions = []
-        self.solutions = []
-        self.parameter = None
-        if self.raw_string == "":
-            self.computing = False
-            return
-        raw_left = None
-        raw_right = None
-        raw_str = self.raw_string.replace("^", "**")
-        x, y = sympy.symbols("x,y")
-        solve_for = y
-        parameter = x
-        self.kind = "x"
-        if "=" in raw_str:
-            raw_left, raw_right = raw_str.split("=", 1)
-            if raw_left.strip() == "x":
-                solve_for = x
-                parameter = y
-                self.kind = "y"
-            try:
-                lefte = sympy.sympify(raw_left)
-                righte = sympy.sympify(raw_right)
-                solutions = sympy.solve(sympy.Equality(lefte, righte), solve_for)
-            except Exception as e:
-                self.error = True
-                self.error_reason = str(e)
-                print(f"ERROR: {self.error_reason}")
-                data.need_to_plot = True
-                self.computing = False
-                return
-        else:
-            raw_right = raw_str.strip()
-            if "y" in raw_right:
-                solve_for = x
-                parameter = y
-                self.kind = "y"
-            try:
-                solutions = sympy.solve(
-                    sympy.Equality(
-                        sympy.sympify(solve_for.name), sympy.sympify(raw_right)
-                    ),
-                    solve_for,
-                )
-            except Exception as e:
-                self.error = True
-                self.error_reason = str(e)
-                print(f"ERROR: {self.error_reason}")
-                data.need_to_plot = True
-                self.computing = False
-                return
-
-        self.parameter = parameter
-        self.solutions = solutions
-        if self.show_derivative:
-            self.compute_derivative(data)
-
-        for solution in solutions:
-            try:
-                func = sympy.lambdify(
-                    [parameter, *data.vars_symbols], solution, "numpy"
-                )
-                self.numpy_functions.append(func)
-            except Exception as e:
-                self.error_reason = str(e)
-                print(f"ERROR: {self.error_reason}")
-                self.computing = False
-                data.need_to_plot = True
-                return
-        if len(self.numpy_functions) <= 0:
-            self.error = True
-            data.need_to_plot = True
-            self.computing = False
-            return
-        data.need_to_plot = True
-        self.computing = False
+        self.sampled = (key, list(self.plots), self.stride)
+        self.finish_plots(data)
+
+    def finish_plots(self, data: PlotData):
+        self.plot_data = data
+        self.plots, self.area_plots = self.shape_plots(self.plots, data)
+
+    def shape_plots(self, plots, data: PlotData):
+        area_plots = []
+        if self.show_area and self.kind != "implicit":
+            # the area layer fills from the raw samples, NaN gaps included
+            area_plots = list(plots)
+        return plots, area_plots
+
+    def sample_adaptive(self, function, kind, data: PlotData):
+        def to_screen(parameters, values):
+            if kind == "y":
+                return self.world_to_screen(values, parameters, data)
+            return self.world_to_screen(parameters, values, data)
+
+        return adaptive_sample(
+            function,
+            data.start,
+            data.stop,
+            data.variables,
+            to_screen,
+            data.viewy if kind == "y" else data.viewx,
+            data.budget,
+        )
 
-    def compute_derivative(self, data):
+    def compute_derivative(self, data: "UserData"):
         if self.should_skip or not self.show_derivative:
             return
         self.derivatives = []
         self.derivative_funcs = []
+        if self.kind == "implicit":
+            self.derivative_error = True
+            self.derivative_error_reason = (
+                "Cannot compute the derivative of an implicit curve"
+            )
+            return
         self.derivative_error = False
         self.derivative_error_reason = None
-        error_count = 0
-        error_reason = None
-        for solution in self.solutions:
-            try:
-                if isinstance(solution, sympy.Abs):
-                    inside = solution.args[0]
-                    inside_left = -inside
-                    inside_der_right = sympy.diff(inside, self.parameter)
-                    inside_der_left = sympy.diff(inside_left, self.parameter)
-                    inside_func_right = sympy.lambdify(
-                        [self.parameter, *data.vars_symbols], inside_der_right, "numpy"
-                    )
-                    inside_func_left = sympy.lambdify(
-                        [self.parameter, *data.vars_symbols], inside_der_left, "numpy"
-                    )
-                    inside_func = sympy.lambdify(
-                        [self.parameter, *data.vars_symbols], inside, "numpy"
-                    )
-                    der_data = {
-                        "left": inside_der_left,
-                        "right": inside_der_right,
-                        "inside": inside,
-                    }
-                    func_data = {
-                        "left": inside_func_left,
-                        "right": inside_func_right,
-                        "inside": inside_func,
+        # tangents use the sampled slopes until the symbolic derivative arrives
+        self.derivative_funcs = [
+            SampledDerivative(self, branch, data)
+            for branch in range(len(self.numpy_functions))
+        ]
+        self.derivative_pending = True
+        data.coordinator.request_derivative(self)
+
+    def publish_derivative(self, result, data: "UserData"):
+        entries = result.get("derivatives")
+        if entries is None:
+            entries = [{"numeric": result.get("error")} for _ in self.numpy_functions]
+        derivatives = []
+        derivative_funcs = []
+        for branch, entry in enumerate(entries):
+            if "numeric" in entry:
+                derivatives.append("sampled numerically")
+                derivative_funcs.append(SampledDerivative(self, branch, data))
+            elif "derivative" in entry:
+                derivatives.append(entry["derivative"]["text"])
+                derivative_funcs.append(
+                    build_numpy_function(entry["derivative"]["function"])
+                )
+            else:
+                derivatives.append({name: entry[name]["text"] for name in entry})
+                derivative_funcs.append(
+                    {
+                        name: build_numpy_function(entry[name]["function"])
+                        for name in entry
                     }
-                    self.derivatives.append(der_data)
-                    self.derivative_funcs.append(func_data)
-                elif isinstance(solution, sympy.sign):
-                    derivative = sympy.Number(0)
-                    derivative_func = sympy.lambdify(
-                        [self.parameter, *data.vars_symbols], derivative, "numpy"
-                    )
-                    self.derivatives.append(derivative)
-                    self.derivative_funcs.append(derivative_func)
-                else:
-                    er = False
-                    if "abs" in self.raw_string:
-                        error_count += 1
-                        error_reason = "Can only compute the derivative of abs if it's the main function"
-                        er = True
-                    for name in ["floor", "ceil", "sign", "sgn"]:
-                        if name in self.raw_string:
-                            error_count += 1
-                            er = True
-                            error_reason = f"Cannot compute the derivative containing the '{name}' function"
-                    if not er:
-                        derivative = sympy.diff(solution, self.parameter)
-                        derivative_func = sympy.lambdify(
-                            [self.parameter, *data.vars_symbols], derivative, "numpy"
-                        )
-                        self.derivatives.append(derivative)
-                        self.derivative_funcs.append(derivative_func)
-            except Exception as e:
-                error_count += 1
-                error_reason = str(e)
-        if error_count == len(self.solutions):
-            self.derivative_error = True
-            self.derivative_error_reason = error_reason
+                )
+        self.derivatives = derivatives
+        self.derivative_funcs = derivative_funcs
+        self.derivative_pending = False
 
 
 class UserData:
     def __init__(self):
         self.expressions: list[UserExpression] = []
         self.variables: list[UserVariable] = []
-        self.vars_symbols = []
+        self.vars_names = []
         self.vars_values = []
+        self.dependents: dict[str, set[UserExpression]] = {}
+        self.dependents_lock = threading.Lock()
         self.precision = 10000
         self.view = pygame.Vector2()
         self.cpos = pygame.Vector2()
         self.czoom = 1
         self.unit = 100
+        self.scene_version = 0
         self.need_to_plot = True
+        self.preview_surface: pygame.Surface = None
+        self.frame_key = None
         self.panel_percentage = 0.2
         self.framerate = 120
+        self.adaptive_sampling = False
+        self.tiled_sampling = True
+        self.float32_plotting = False
+        self.profiler = Profiler()
+        self.tile_cache = TileCache()
+        self.plot_index = PlotIndex()
+        self.index_versions = itertools.count(1)
+        self.built_index = PlotIndex()
+        self.hover_cache = HoverCache()
+        self.plot_buffer = PlotBuffer()
+        self.text_cache = TextCache()
+        self.grid_layer = GridLayer()
+        self.area_layer = AreaLayer()
         self.font_pad = 0
         self.font: pygame.Font = None
         self.font_size = FONT_SIZE
+        self.compile_cache = CompileCache()
+        self.solver = SolverPool()
+        self.coordinator = ComputeCoordinator(self)
+        self.renderer = RenderWorker(self)
+        self.animation = VariableAnimation(self)
+        self.idle = IdleScheduler(self)
         self.font = pygame.font.SysFont("Segoe UI", FONT_SIZE)
         if os.path.exists("appdata/data.json"):
             self.load()
@@ -325,6 +444,9 @@ class UserData:
             self.panel_percentage = data["panel_percentage"]
             self.view = pygame.Vector2(data["view"])
             self.framerate = data["framerate"]
+            self.adaptive_sampling = data.get("adaptive_sampling", False)
+            self.tiled_sampling = data.get("tiled_sampling", True)
+            self.float32_plotting = data.get("float32_plotting", False)
             for var in data["variables"]:
                 self.variables.append(
                     UserVariable(var["name"], var["value"], var["vrange"])
@@ -344,6 +466,9 @@ class UserData:
                     "precision": self.precision,
                     "view": (*self.view,),
                     "framerate": self.framerate,
+                    "adaptive_sampling": self.adaptive_sampling,
+                    "tiled_sampling": self.tiled_sampling,
+                    "float32_plotting": self.float32_plotting,
                     "variables": [
                         {"name": var.name, "value": var.value, "vrange": var.vrange}
                         for var in self.variables
@@ -355,41 +480,181 @@ class UserData:
                 },
                 file,
             )
+        self.compile_cache.save()
+
+    def quit(self):
+        self.animation.shutdown()
+        self.save()
+        self.renderer.shutdown()
+        self.coordinator.shutdown()
+        self.solver.shutdown()
+
+    @property
+    def need_to_plot(self):
+        return self._need_to_plot
+
+    @need_to_plot.setter
+    def need_to_plot(self, value):
+        # anything but a camera move invalidates the pixels of the previous frame
+        if value:
+            self.scene_version += 1
+        self._need_to_plot = value
 
     def refresh_vars_symbols(self):
-        self.vars_symbols = [
-            sympy.Symbol(var.name, real=True) for var in self.variables
-        ]
+        self.vars_names = [var.name for var in self.variables]
         self.vars_values = [var.value for var in self.variables]
 
-    def camera_to_range(self):
-        view_world_width = self.view.x / (self.czoom * self.unit)
-        view_world_height = self.view.y / (self.czoom * self.unit)
+    def track(self, expression: UserExpression, previous, current):
+        with self.dependents_lock:
+            for name in previous:
+                users = self.dependents.get(name)
+                if users is not None:
+                    users.discard(expression)
+                    if len(users) <= 0:
+                        self.dependents.pop(name)
+            for name in current:
+                self.dependents.setdefault(name, set()).add(expression)
+
+    def users_of(self, names):
+        with self.dependents_lock:
+            return set().union(*(self.dependents.get(name, ()) for name in names))
+
+    def set_variable(self, index, value):
+        # plots key on the values they use, so only dependent expressions resample
+        variable = self.variables[index]
+        variable.value = value
+        self.vars_values[index] = value
+        if len(self.users_of([variable.name])) > 0:
+            self.need_to_plot = True
+
+    def add_variable(self, variable: UserVariable):
+        self.variables.append(variable)
+        self.variables_changed([variable.name])
+
+    def rename_variable(self, index, name):
+        variable = self.variables[index]
+        previous, variable.name = variable.name, name
+        self.variables_changed([previous, name])
+
+    def remove_variable(self, index):
+        variable = self.variables.pop(index)
+        self.variables_changed([variable.name])
+
+    def variables_changed(self, names):
+        self.refresh_vars_symbols()
+        # only expressions mentioning a changed name see different symbols
+        for expression in self.users_of(names):
+            if expression in self.expressions:
+                expression.send_compute(self)
+        self.need_to_plot = True
 
-        x_start = self.cpos.x - view_world_width / 2
-        x_end = self.cpos.x + view_world_width / 2
+    def remove_expression(self, expression: UserExpression):
+        # removed first, so the coordinator sees a deleted expression and kills its solve
+        self.expressions.remove(expression)
+        expression.cancel_compute(self)
+        self.track(expression, expression.snapshot.dependencies, ())
+        self.need_to_plot = True
 
-        y_start = self.cpos.y + view_world_height / 2
-        y_end = self.cpos.y - view_world_height / 2
+    def camera_to_range(self, frame: "RenderFrame" = None):
+        if frame is None:
+            frame = self
+        view_world_width = frame.view.x / (frame.czoom * frame.unit)
+        view_world_height = frame.view.y / (frame.czoom * frame.unit)
 
-        x_step = (x_end - x_start) / self.precision
-        y_step = (y_end - y_start) / self.precision
+        x_start = frame.cpos.x - view_world_width / 2
+        x_end = frame.cpos.x + view_world_width / 2
+
+        y_start = frame.cpos.y + view_world_height / 2
+        y_end = frame.cpos.y - view_world_height / 2
+
+        x_step = (x_end - x_start) / frame.precision
+        y_step = (y_end - y_start) / frame.precision
 
         return ((x_start, x_end, x_step), (y_start, y_end, y_step))
 
-    def plot(self):
-        (xs, xe, xst), (ys, ye, yst) = self.camera_to_range()
+    @property
+    def coarse_stride(self):
+        # the first pass keeps the same sample count whatever precision is chosen
+        if self.adaptive_sampling:
+            return 1
+        return 2 ** max(
+            int(numpy.ceil(numpy.log2(self.precision / PROGRESSIVE_SAMPLES))), 0
+        )
+
+    def plot_data(
+        self,
+        adaptive=False,
+        budget=None,
+        tiles=None,
+        stride=1,
+        frame: "RenderFrame" = None,
+    ):
+        if frame is None:
+            frame = self
+        (xs, xe, xst), (ys, ye, yst) = self.camera_to_range(frame)
+        dtype = numpy.float32 if frame.float32_plotting else numpy.float64
+        if tiles is None:
+            # without tiles there is nothing to merge into, a pass just samples sparser
+            xst, yst = xst * stride, yst * stride
         plotx = PlotData(
-            xs, xe, xst, self.vars_values, self.cpos, self.czoom, self.unit, self.view
+            xs,
+            xe,
+            xst,
+            list(frame.vars_values),
+            pygame.Vector2(frame.cpos),
+            frame.czoom,
+            frame.unit,
+            pygame.Vector2(frame.view),
+            adaptive,
+            budget,
+            tiles,
+            dtype,
+            stride,
+            list(frame.vars_names),
         )
         ploty = PlotData(
-            ys, ye, yst, self.vars_values, self.cpos, self.czoom, self.unit, self.view
+            ys,
+            ye,
+            yst,
+            list(frame.vars_values),
+            pygame.Vector2(frame.cpos),
+            frame.czoom,
+            frame.unit,
+            pygame.Vector2(frame.view),
+            adaptive,
+            budget,
+            tiles,
+            dtype,
+            stride,
+            list(frame.vars_names),
         )
-        for expression in self.expressions:
-            plot = plotx
-            if expression.kind == "y":
-                plot = ploty
-            expression.plot(plot)
+        return plotx, ploty
+
+    def plot(self, stride=1, frame: "RenderFrame" = None):
+        if frame is None:
+            frame = self
+        budget = None
+        if frame.adaptive_sampling:
+            budget = EvaluationBudget(
+                ADAPTIVE_BUDGET,
+                sum(
+                    len(expression.numpy_functions)
+                    for expression in frame.expressions
+                    if not expression.error
+                ),
+            )
+        plotx, ploty = self.plot_data(
+            frame.adaptive_sampling,
+            budget,
+            self.tile_cache if frame.tiled_sampling else None,
+            stride,
+            frame,
+        )
+        self.plot_buffer.plot(frame.expressions, plotx, ploty)
+        return self.camera_crange(frame)
+
+    def camera_crange(self, frame: "RenderFrame" = None):
+        (xs, xe, _), (ys, ye, _) = self.camera_to_range(frame)
         return [(xs, xe), (ys, ye)]
 
     def screen_to_world(self, screen_pos):
@@ -398,40 +663,46 @@ class UserData:
             -(screen_pos[1] - self.view.y / 2) / self.czoom / self.unit + self.cpos.y,
         )
 
-    def world_to_screen(self, world_pos):
+    def world_to_screen(self, world_pos, frame: "RenderFrame" = None):
+        if frame is None:
+            frame = self
         return pygame.Vector2(
-            (world_pos[0] - self.cpos.x) * self.czoom * self.unit + self.view.x / 2,
-            -(world_pos[1] - self.cpos.y) * self.czoom * self.unit + self.view.y / 2,
+            (world_pos[0] - frame.cpos.x) * frame.czoom * frame.unit + frame.view.x / 2,
+            -(world_pos[1] - frame.cpos.y) * frame.czoom * frame.unit
+            + frame.view.y / 2,
         )
 
-    def draw_grid(self, screen: pygame.Surface, crange):
-        (xs, xe), (ys, ye) = crange
+    def grid_layout(self, crange, frame: "RenderFrame"):
+        xs, xe = crange[0]
+        ys = crange[1][0]
         xw = abs(xe - xs)
         raw_step = xw / CELL_NUMBER
         cell_base = 10 ** numpy.floor(numpy.log10(raw_step))
         cell_candidates = numpy.array([1, 2, 5, 10]) * cell_base
         world_cell = cell_candidates[cell_candidates >= raw_step][0]
-        cell_w = world_cell * self.unit * self.czoom
+        cell_w = world_cell * frame.unit * frame.czoom
         world_left = numpy.floor(xs / world_cell) * world_cell
         world_top = numpy.floor(ys / world_cell) * world_cell
-        cur_x = self.world_to_screen((world_left, 0)).x
-        cur_y = self.world_to_screen((0, world_top)).y
+        cur_x = self.world_to_screen((world_left, 0), frame).x
+        cur_y = self.world_to_screen((0, world_top), frame).y
         startx, starty = cur_x, cur_y
-        for _ in range(CELL_NUMBER + 1):
-            pygame.draw.line(screen, GRID_COL, (cur_x, 0), (cur_x, self.view.y))
-            pygame.draw.line(screen, GRID_COL, (0, cur_y), (self.view.x, cur_y))
-            cur_x += cell_w
-            cur_y += cell_w
-        center_scr = self.world_to_screen((0, 0))
+        center_scr = self.world_to_screen((0, 0), frame)
+        return center_scr, startx, starty, cell_w, world_left, world_top, world_cell
+
+    def draw_grid(self, screen: pygame.Surface, crange, frame: "RenderFrame"):
+        (xs, xe), (ys, ye) = crange
+        layout = self.grid_layout(crange, frame)
+        center_scr, startx, starty, cell_w = layout[:4]
+        self.grid_layer.draw(screen, frame.view, cell_w, layout[6], startx, starty)
         if xs < 0 < xe or xs < 0 < xe:
             pygame.draw.line(
-                screen, AXIS_COL, (center_scr.x, 0), (center_scr.x, self.view.y)
+                screen, AXIS_COL, (center_scr.x, 0), (center_scr.x, frame.view.y)
             )
         if ys < 0 < ye or ye < 0 < ys:
             pygame.draw.line(
-                screen, AXIS_COL, (0, center_scr.y), (self.view.x, center_scr.y)
+                screen, AXIS_COL, (0, center_scr.y), (frame.view.x, center_scr.y)
             )
-        return center_scr, startx, starty, cell_w, world_left, world_top, world_cell
+        return layout
 
     def draw_text(
         self,
@@ -443,6 +714,7 @@ class UserData:
         wl,
         wt,
         world_cell,
+        frame: "RenderFrame",
     ):
         cur_x = sx
         cur_y = sy
@@ -454,11 +726,11 @@ class UserData:
                 world_x = 0
             if abs(cur_y - center.y) <= 1:
                 world_y = 0
-                if 0 < center.x < self.view.x:
+                if 0 < center.x < frame.view.x:
                     rendery = False
-            x_surf = self.font.render(self.format_number(world_x), True, AXIS_COL)
+            x_surf = self.render_text(self.format_number(world_x), AXIS_COL)
             if rendery:
-                y_surf = self.font.render(self.format_number(world_y), True, AXIS_COL)
+                y_surf = self.render_text(self.format_number(world_y), AXIS_COL)
             screen.blit(
                 x_surf,
                 x_surf.get_rect(
@@ -467,7 +739,7 @@ class UserData:
                         pygame.math.clamp(
                             center.y + self.font_pad,
                             self.font_pad,
-                            self.view.y - self.font_pad - x_surf.height,
+                            frame.view.y - self.font_pad - x_surf.height,
                         ),
                     )
                 ),
@@ -480,7 +752,7 @@ class UserData:
                             pygame.math.clamp(
                                 center.x + self.font_pad,
                                 self.font_pad,
-                                self.view.x - self.font_pad - y_surf.width,
+                                frame.view.x - self.font_pad - y_surf.width,
                             ),
                             cur_y + self.font_pad,
                         )
@@ -491,6 +763,9 @@ class UserData:
             world_x += world_cell
             world_y -= world_cell
 
+    def render_text(self, text, color):
+        return self.text_cache.render(self.font, self.font_size, text, color)
+
     def format_number(self, value, decimal_places=3, sci_threshold=5):
         if value == 0:
             return "0"
@@ -500,107 +775,226 @@ class UserData:
         else:
             return f"{value:.{decimal_places}f}".rstrip("0").rstrip(".")
 
-    def draw_expressions(self, screen: pygame.Surface):
-        for expression in self.expressions:
+    def draw_expressions(
+        self, screen: pygame.Surface, frame: "RenderFrame", clip: pygame.Rect = None
+    ):
+        for expression in frame.expressions:
             if expression.should_skip:
                 continue
-            if expression.show_area:
+            if expression.show_area and expression.kind != "implicit":
+                zero = self.world_to_screen((0, 0), frame)
+                axis = 1 if expression.kind == "y" else 0
                 for plot in expression.area_plots:
                     try:
-                        self.draw_area(expression, plot, screen)
+                        self.area_layer.draw(
+                            screen, plot, axis, zero[1 - axis], expression.color
+                        )
                     except Exception as e:
                         print(f"ERROR: {e}")
             else:
+                axis = 1 if expression.kind == "y" else 0
                 for i, plot in enumerate(expression.plots):
                     try:
-                        pygame.draw.aalines(screen, expression.color, False, plot)
+                        # contours are traced on the screen grid and never leave it
+                        if expression.kind == "implicit":
+                            pygame.draw.aalines(screen, expression.color, False, plot)
+                            continue
+                        if clip is not None:
+                            edges = ((clip.left, clip.right), (clip.top, clip.bottom))
+                            plot = axis_span(plot, axis, *edges[axis])
+                        plot = decimate_columns(plot, frame.view[axis], axis)
+                        for run in visible_runs(plot, frame.view, axis, clip=clip):
+                            pygame.draw.aalines(screen, expression.color, False, run)
                     except Exception as e:
                         print(f"ERROR: {e}")
 
-    def draw_area(self, expr: UserExpression, points, screen):
-        zeroh = self.world_to_screen((0, 0)).y
-        left = numpy.asarray([points[0][0], zeroh])
-        right = numpy.asarray([points[-1][0], zeroh])
-        pygame.draw.polygon(
-            screen,
-            expr.color,
-            numpy.concatenate(
-                [
-                    numpy.asarray([left]),
-                    points,
-                    numpy.asarray([right]),
-                ]
-            ),
+    def hover_key(self, mouse):
+        return (
+            mouse[0],
+            mouse[1],
+            self.cpos.x,
+            self.cpos.y,
+            self.czoom,
+            self.view.x,
+            self.view.y,
+            tuple(self.vars_values),
+            self.plot_index.version,
         )
 
-    def get_closest_point(self, points, mouse):
-        try:
-            points = points[~numpy.isnan(points).any(axis=1)]
-            if len(points) <= 0:
-                return
-            deltas = points - mouse
-            dist_sq = numpy.sum(deltas**2, axis=1)
-            idx = numpy.argmin(dist_sq)
-            return points[idx]
-        except Exception as e:
-            print(f"ERROR: {e}")
-            return
+    def sample_at(self, expr: UserExpression, branch, coord):
+        index = self.plot_index.axes.get((expr, branch))
+        if index is None:
+            return None, None
+        return index.interpolate(coord)
+
+    def derivative_at(self, expr: UserExpression, derivative_func, coord):
+        arguments = expr.arguments(self)
+        if isinstance(derivative_func, dict):
+            if derivative_func["inside"](coord, *arguments) >= 0:
+                derivative_func = derivative_func["right"]
+            else:
+                derivative_func = derivative_func["left"]
+        return derivative_func(coord, *arguments)
 
     def get_tangent_points(
-        self, expr: UserExpression, derivative_func, numpy_function, mouse_coord
+        self,
+        expr: UserExpression,
+        derivative_func,
+        numpy_function,
+        mouse_coord,
+        branch=None,
     ):
-        with numpy.errstate(divide="ignore", invalid="ignore"):
-            tangent_slope = derivative_func(mouse_coord, *self.vars_values)
+        y0, tangent_slope = self.sample_at(expr, branch, mouse_coord)
+        if tangent_slope is None:
+            with numpy.errstate(divide="ignore", invalid="ignore"):
+                tangent_slope = self.derivative_at(expr, derivative_func, mouse_coord)
         if numpy.isnan(tangent_slope) or numpy.isinf(tangent_slope):
             return
-        with numpy.errstate(divide="ignore", invalid="ignore"):
-            y0 = numpy_function(mouse_coord, *self.vars_values)
+        if y0 is None:
+            with numpy.errstate(divide="ignore", invalid="ignore"):
+                y0 = numpy_function(mouse_coord, *expr.arguments(self))
         if numpy.isnan(y0) or numpy.isinf(y0):
             return
-        (xs, xe, xst), (ys, ye, _) = self.camera_to_range()
+        (xs, xe, _), (ys, ye, _) = self.camera_to_range()
         tp = (mouse_coord, y0)
         if expr.kind == "x":
-            xarr = numpy.asarray([xs, xe])
+            start, end = xs, xe
         else:
-            xarr = numpy.asarray([ys, ye])
-        yarr = tangent_slope * (xarr - mouse_coord) + y0
-        rs, re = xarr, yarr
+            start, end = ys, ye
+        ends = [(start, tangent_slope * (start - mouse_coord) + y0)]
+        ends.append((end, tangent_slope * (end - mouse_coord) + y0))
         if expr.kind == "y":
-            (
-                rs,
-                re,
-            ) = yarr, xarr
+            ends = [(value, coord) for coord, value in ends]
             tp = (y0, mouse_coord)
-        rs, re = expr.world_to_screen(
-            rs,
-            re,
-            PlotData(
-                xs,
-                xe,
-                xst,
-                self.variables,
-                self.cpos,
-                self.czoom,
-                self.unit,
-                self.view,
-            ),
-        )
         return (
-            numpy.column_stack((rs, re)),
+            numpy.asarray([self.world_to_screen(point) for point in ends]),
             self.world_to_screen(tp),
             tangent_slope,
             tp[1],
         )
 
-    def update(self, screen: pygame.Surface):
+    def get_closest_value(self, mouse, world_mouse):
+        closest = None
+        col = None
+        for expression in self.expressions:
+            if expression.should_skip or expression.kind == "implicit":
+                continue
+            coord = world_mouse.y if expression.kind == "y" else world_mouse.x
+            for branch, func in enumerate(expression.numpy_functions):
+                value, _ = self.sample_at(expression, branch, coord)
+                if value is None:
+                    with numpy.errstate(divide="ignore", invalid="ignore"):
+                        value = func(coord, *expression.arguments(self))
+                if numpy.isnan(value) or numpy.isinf(value):
+                    continue
+                wpoint = (coord, value)
+                if expression.kind == "y":
+                    wpoint = (value, coord)
+                spoint = self.world_to_screen(wpoint)
+                dist = (spoint - mouse).magnitude()
+                if dist > HOVER_MAX_DIST:
+                    continue
+                if closest is None or dist < (closest - mouse).magnitude():
+                    closest = spoint
+                    col = expression.color
+        if closest is None:
+            return
+        return closest, col
+
+    def prepare(self, frame: "RenderFrame", stride=1):
+        with self.profiler.span("plot"):
+            if self.animation.apply(frame):
+                crange = self.camera_crange(frame)
+            else:
+                crange = self.plot(stride, frame)
+        with self.profiler.span("plot_index"):
+            # hover reads the index from the UI thread, so each frame gets its own
+            index = PlotIndex(next(self.index_versions))
+            index.build(frame.expressions, frame.view, self.built_index)
+            self.built_index = index
+        # cached tiles can already be finer than the pass asked for
+        stride = max((expression.stride for expression in frame.expressions), default=1)
+        return crange, index, stride
+
+    def draw(
+        self,
+        screen: pygame.Surface,
+        crange,
+        frame: "RenderFrame",
+        clip: pygame.Rect = None,
+    ):
+        with self.profiler.span("draw_grid"):
+            self.draw_grid(screen, crange, frame)
+        with self.profiler.span("draw_expressions"):
+            self.draw_expressions(screen, frame, clip)
+
+    def draw_labels(self, screen: pygame.Surface, crange, frame: "RenderFrame"):
+        # labels pinned to the view edges do not move with the grid, so they
+        # go over the whole frame instead of being scrolled with it
+        with self.profiler.span("draw_text"):
+            center, sx, sy, cw, wl, wt, wc = self.grid_layout(crange, frame)
+            self.draw_text(screen, center, sx, sy, cw, wl, wt, wc, frame)
+
+    def update(self, size):
+        self.view = pygame.Vector2(size)
         if self.need_to_plot:
-            self.view = pygame.Vector2(screen.size)
-            crange = self.plot()
-            screen.fill("black")
-            center, sx, sy, cw, wl, wt, wc = self.draw_grid(screen, crange)
-            self.draw_expressions(screen)
-            self.draw_text(screen, center, sx, sy, cw, wl, wt, wc)
             self.need_to_plot = False
+            self.renderer.request(size)
+        frame, camera = self.renderer.present()
+        current = self.camera_state(frame.size)
+        if camera is None or camera == current:
+            self.frame_key = (frame, camera)
+            return frame
+        if self.frame_key != (frame, camera, current):
+            self.frame_key = (frame, camera, current)
+            self.preview(frame, camera)
+        return self.preview_surface
+
+    def preview(self, frame: pygame.Surface, camera):
+        # the last frame moved to the current camera stands in until the render lands
+        if self.preview_surface is None or self.preview_surface.size != frame.size:
+            self.preview_surface = pygame.Surface(frame.size, pygame.SRCALPHA)
+        self.preview_surface.fill(0)
+        x, y, zoom, unit, _ = camera
+        scale = self.czoom * self.unit
+        factor = scale / (zoom * unit)
+        half = pygame.Vector2(frame.size) / 2
+        position = half - half * factor
+        position += ((x - self.cpos.x) * scale, (self.cpos.y - y) * scale)
+        if factor == 1:
+            self.preview_surface.blit(
+                frame,
+                (round(position.x), round(position.y)),
+                special_flags=pygame.BLEND_RGBA_ADD,
+            )
+            return
+        source = pygame.Rect(
+            -position / factor, pygame.Vector2(frame.size) / factor
+        ).inflate(2, 2)
+        source = source.clip(frame.get_rect())
+        if source.w <= 0 or source.h <= 0:
+            return
+        size = (
+            max(int(source.w * factor), 1),
+            max(int(source.h * factor), 1),
+        )
+        position += pygame.Vector2(source.topleft) * factor
+        self.preview_surface.blit(
+            pygame.transform.scale(frame.subsurface(source), size),
+            (round(position.x), round(position.y)),
+            special_flags=pygame.BLEND_RGBA_ADD,
+        )
+
+    def camera_state(self, size=None):
+        if size is None:
+            size = (int(self.view.x), int(self.view.y))
+        return (self.cpos.x, self.cpos.y, self.czoom, self.unit, tuple(size))
+
+    def move_camera(self, cpos, czoom):
+        # camera moves keep the scene, so the renderer may scroll the previous frame
+        self.cpos = pygame.Vector2(cpos)
+        self.czoom = czoom
+        self._need_to_plot = True
 
     def reset_cam(self):
         self.cpos = pygame.Vector2(0, 0)
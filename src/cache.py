@@ -0,0 +1,311 @@
+from .common import *
+import collections
+import importlib.metadata
+import threading
+import hashlib
+import inspect
+import json
+import os
+import re
+import types
+
+# what NumPyPrinter emits for the functions sympy can hand to numpy, nothing
+# that reaches files, pickles or the builtins
+NUMPY_NAMES = (
+    "abs",
+    "amax",
+    "amin",
+    "angle",
+    "arccos",
+    "arccosh",
+    "arcsin",
+    "arcsinh",
+    "arctan",
+    "arctan2",
+    "arctanh",
+    "asarray",
+    "cbrt",
+    "ceil",
+    "conjugate",
+    "cos",
+    "cosh",
+    "e",
+    "equal",
+    "euler_gamma",
+    "exp",
+    "exp2",
+    "expm1",
+    "floor",
+    "fmod",
+    "greater",
+    "greater_equal",
+    "heaviside",
+    "hypot",
+    "imag",
+    "inf",
+    "isinf",
+    "isnan",
+    "less",
+    "less_equal",
+    "log",
+    "log10",
+    "log1p",
+    "log2",
+    "logical_and",
+    "logical_not",
+    "logical_or",
+    "logical_xor",
+    "maximum",
+    "minimum",
+    "mod",
+    "nan",
+    "not_equal",
+    "pi",
+    "power",
+    "real",
+    "select",
+    "sign",
+    "sin",
+    "sinc",
+    "sinh",
+    "sqrt",
+    "tan",
+    "tanh",
+    "where",
+)
+NUMPY_NAMESPACE = {name: getattr(numpy, name) for name in NUMPY_NAMES}
+NUMPY_NAMESPACE["I"] = 1j
+
+
+def build_numpy_function(source):
+    # sources come back from the cache file, so they pass the same check again
+    code = compile(source, "<lambdifygenerated>", "exec")
+    functions = [const for const in code.co_consts if isinstance(const, types.CodeType)]
+    if (
+        code.co_names != ("_lambdifygenerated",)
+        or len(functions) != 1
+        or not uses_numpy_only(functions[0])
+    ):
+        raise ValueError("Compiled function uses names outside of numpy")
+    namespace = dict(NUMPY_NAMESPACE)
+    namespace["__builtins__"] = {}
+    exec(code, namespace)
+    return namespace["_lambdifygenerated"]
+
+
+def uses_numpy_only(code: types.CodeType):
+    args = code.co_varnames[: code.co_argcount]
+    for name in code.co_names:
+        if name not in NUMPY_NAMESPACE and name not in args:
+            return False
+    return all(
+        uses_numpy_only(const)
+        for const in code.co_consts
+        if isinstance(const, types.CodeType)
+    )
+
+
+def numpy_function_source(func):
+    try:
+        source = inspect.getsource(func)
+    except (OSError, TypeError):
+        return None
+    if not uses_numpy_only(func.__code__):
+        return None
+    return source
+
+
+class CompiledExpression:
+    def __init__(
+        self,
+        kind,
+        parameter_name,
+        solution_sources,
+        function_sources,
+        solutions=None,
+        numpy_functions=None,
+        variables=(),
+        dependencies=(),
+    ):
+        self.kind = kind
+        self.parameter_name = parameter_name
+        self.solution_sources = solution_sources
+        self.function_sources = function_sources
+        self._solutions = solutions
+        if numpy_functions is None:
+            numpy_functions = [
+                build_numpy_function(source) for source in function_sources
+            ]
+        self.numpy_functions = numpy_functions
+        self.variables = tuple(variables)
+        self.dependencies = frozenset(dependencies)
+
+    @classmethod
+    def from_sympy(cls, kind, parameter, solutions, numpy_functions):
+        function_sources = [numpy_function_source(func) for func in numpy_functions]
+        if None in function_sources:
+            function_sources = None
+        return cls(
+            kind,
+            parameter.name,
+            [sympy.srepr(solution) for solution in solutions],
+            function_sources,
+            solutions,
+            numpy_functions,
+        )
+
+    @property
+    def persistable(self):
+        return self.function_sources is not None
+
+    @property
+    def parameter(self):
+        return sympy.Symbol(self.parameter_name)
+
+    @property
+    def solutions(self):
+        if self._solutions is None:
+            self._solutions = [
+                sympy.sympify(source) for source in self.solution_sources
+            ]
+        return self._solutions
+
+    def to_json(self, variables):
+        return {
+            "kind": self.kind,
+            "parameter": self.parameter_name,
+            "variables": list(variables),
+            "dependencies": sorted(self.dependencies),
+            "solutions": self.solution_sources,
+            "functions": self.function_sources,
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(
+            data["kind"],
+            data["parameter"],
+            data["solutions"],
+            data["functions"],
+            variables=data["variables"],
+            dependencies=data["dependencies"],
+        )
+
+
+class CompileCache:
+    def __init__(self, capacity=COMPILE_CACHE_SIZE, path=COMPILE_CACHE_PATH):
+        self.capacity = capacity
+        self.path = path
+        self.entries: collections.OrderedDict[tuple, CompiledExpression] = (
+            collections.OrderedDict()
+        )
+        self.disk_entries: collections.OrderedDict[str, dict] = (
+            collections.OrderedDict()
+        )
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        if self.path is not None and os.path.exists(self.path):
+            self.load()
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        if total == 0:
+            return 0
+        return self.hits / total
+
+    @property
+    def version(self):
+        try:
+            sympy_version = importlib.metadata.version("sympy")
+        except importlib.metadata.PackageNotFoundError:
+            sympy_version = None
+        return [COMPILE_CACHE_VERSION, sympy_version, numpy.__version__]
+
+    def normalize(self, raw_string):
+        normalized = raw_string.replace("^", "**")
+        normalized = re.sub(r"\s*([-+*/=(),])\s*", r"\1", normalized)
+        return re.sub(r"\s+", " ", normalized).strip()
+
+    def make_key(self, raw_string, vars_names):
+        return (self.normalize(raw_string), tuple(vars_names))
+
+    def disk_key(self, key):
+        source, variables = key
+        digest = hashlib.sha1(source.encode()).hexdigest()
+        return f"{digest}|{','.join(variables)}"
+
+    def contains(self, key):
+        with self.lock:
+            return key in self.entries or self.disk_key(key) in self.disk_entries
+
+    def get(self, key):
+        with self.lock:
+            compiled = self.entries.get(key)
+            if compiled is None:
+                compiled = self.get_from_disk(key)
+            if compiled is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return compiled
+
+    def get_from_disk(self, key):
+        disk_key = self.disk_key(key)
+        data = self.disk_entries.get(disk_key)
+        if data is None:
+            return None
+        try:
+            compiled = CompiledExpression.from_json(data)
+        except Exception as e:
+            print(f"ERROR: {e}")
+            self.disk_entries.pop(disk_key)
+            return None
+        self.disk_entries.move_to_end(disk_key)
+        self.entries[key] = compiled
+        self.trim()
+        return compiled
+
+    def put(self, key, compiled: CompiledExpression):
+        with self.lock:
+            self.entries[key] = compiled
+            self.entries.move_to_end(key)
+            if compiled.persistable:
+                disk_key = self.disk_key(key)
+                self.disk_entries[disk_key] = compiled.to_json(key[1])
+                self.disk_entries.move_to_end(disk_key)
+            self.trim()
+
+    def trim(self):
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+        while len(self.disk_entries) > self.capacity:
+            self.disk_entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.disk_entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def load(self):
+        try:
+            with open(self.path) as file:
+                data = json.load(file)
+        except (OSError, ValueError) as e:
+            print(f"ERROR: {e}")
+            return
+        if data.get("version") != self.version:
+            return
+        self.disk_entries.update(data["entries"])
+
+    def save(self):
+        if self.path is None:
+            return
+        with self.lock:
+            entries = dict(self.disk_entries)
+        with open(self.path, "w") as file:
+            json.dump({"version": self.version, "entries": entries}, file)
@@ -1,13 +1,30 @@
 import pygame
 import mili
 import numpy
-import sympy
 import typing
+import importlib
 
 if typing.TYPE_CHECKING:
     from main import MathGraphCapolavoro2025
 
 
+class LazyModule:
+    def __init__(self, name):
+        self.name = name
+        self.module = None
+
+    @property
+    def loaded(self):
+        return self.module is not None
+
+    def __getattr__(self, attr):
+        if self.module is None:
+            self.module = importlib.import_module(self.name)
+        return getattr(self.module, attr)
+
+
+sympy = LazyModule("sympy")
+
 
 SURF = pygame.Surface((10, 10), pygame.SRCALPHA)
 BTNS = (40, 40, 40), (60,60,60), (32,32,32)
@@ -26,3 +43,46 @@ GRID_COL = (40,)*3
 AXIS_COL = (100,)*3
 CELL_NUMBER = 16
 FONT_SIZE = 15
+COMPILE_CACHE_SIZE = 256
+COMPILE_CACHE_PATH = "appdata/compile_cache.json"
+COMPILE_CACHE_VERSION = 2
+SOLVER_WORKERS = 2
+SOLVE_TIMEOUT = 8
+SOLVER_POLL = 0.05
+SPECULATIVE_DELAY = 150
+ADAPTIVE_TOLERANCE = 0.5
+ADAPTIVE_COARSE_PIXELS = 8
+ADAPTIVE_MIN_PIXEL = 0.25
+ADAPTIVE_BUDGET = 200000
+TILE_PIXELS = 256
+TILE_CACHE_BYTES = 64 * 1024 * 1024
+DECIMATE_FACTOR = 4
+TEXT_CACHE_SIZE = 512
+RENDER_MAX_LATENCY = 100
+IMPLICIT_COARSE_PIXELS = 8
+IMPLICIT_MIN_PIXEL = 1
+IMPLICIT_MAX_CELLS = 200000
+ANIMATION_SECONDS = 4
+ANIMATION_RANGE = 5
+ANIMATION_BLOCK = 16
+ANIMATION_LOOKAHEAD = 120
+ANIMATION_BUFFER_BYTES = 128 * 1024 * 1024
+PROFILER_WINDOW = 120
+PROFILER_RECORD_SECONDS = 5
+PROFILER_TRACE_DIR = "appdata"
+PROFILER_OVERLAY_REFRESH = 250
+POLYLINE_CLIP_MARGIN = 2
+POLYLINE_CLIP_LIMIT = 1000
+AREA_ALPHA = 150
+DERIVATIVE_JUMP_PIXELS = 4
+DERIVATIVE_JUMP_RATIO = 8
+HOVER_INTERPOLATION_TOLERANCE = 1e-4
+IDLE_DELAY = 500
+IDLE_TIMEOUT = 1000
+IDLE_REPORT_PERIOD = 1000
+IDLE_WAKE_EVENT = pygame.event.custom_type()
+RENDER_SETTLE_DELAY = 150
+RENDER_SCROLL_EPSILON = 0.01
+PROGRESSIVE_SAMPLES = 1024
+PROGRESSIVE_FACTOR = 4
+GRID_ZOOM_STEPS = 4
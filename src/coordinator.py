@@ -0,0 +1,267 @@
+from .common import *
+from .cache import CompiledExpression
+from .solver import SolveJob
+import threading
+
+if typing.TYPE_CHECKING:
+    from .bridge import UserData, UserExpression
+
+
+class CompiledSnapshot:
+    __slots__ = (
+        "generation",
+        "raw_string",
+        "compiled",
+        "kind",
+        "numpy_functions",
+        "error",
+        "error_reason",
+        "variables",
+        "dependencies",
+    )
+
+    def __init__(
+        self,
+        generation=0,
+        raw_string="",
+        compiled: CompiledExpression = None,
+        error_reason=None,
+        dependencies=(),
+    ):
+        self.generation = generation
+        self.raw_string = raw_string
+        self.compiled = compiled
+        self.kind = "x" if compiled is None else compiled.kind
+        self.numpy_functions = (
+            () if compiled is None else tuple(compiled.numpy_functions)
+        )
+        self.error = error_reason is not None
+        self.error_reason = error_reason
+        self.variables = () if compiled is None else compiled.variables
+        self.dependencies = (
+            frozenset(dependencies) if compiled is None else compiled.dependencies
+        )
+
+
+class ComputeRequest:
+    def __init__(
+        self, expression: "UserExpression", raw_string, generation, speculative
+    ):
+        self.expression = expression
+        self.raw_string = raw_string
+        self.generation = generation
+        self.speculative = speculative
+        self.key = None
+        self.job: SolveJob = None
+
+    @property
+    def stale(self):
+        return self.expression.generation != self.generation
+
+
+class ComputeCoordinator:
+    def __init__(self, data: "UserData"):
+        self.data = data
+        self.pending: dict["UserExpression", ComputeRequest] = {}
+        self.active: list[ComputeRequest] = []
+        self.inflight: dict[tuple, SolveJob] = {}
+        self.derivatives: dict["UserExpression", tuple[int, SolveJob]] = {}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.running = False
+
+    @property
+    def busy(self):
+        return len(self.pending) > 0 or len(self.active) > 0
+
+    def request(self, expression: "UserExpression", raw_string=None, speculative=False):
+        if raw_string is None:
+            raw_string = expression.raw_string
+        expression.generation += 1
+        request = ComputeRequest(
+            expression, raw_string, expression.generation, speculative
+        )
+        if not speculative:
+            cache = self.data.compile_cache
+            key = cache.make_key(raw_string, self.data.vars_names)
+            compiled = None
+            if raw_string != "" and cache.contains(key):
+                compiled = cache.get(key)
+            if raw_string == "" or compiled is not None:
+                with self.lock:
+                    self.pending.pop(expression, None)
+                self.finish(request, compiled, None)
+                return
+        with self.lock:
+            self.pending[expression] = request
+            self.start_thread()
+        self.wakeup.set()
+
+    def request_derivative(self, expression: "UserExpression"):
+        compiled = expression.compiled
+        if compiled is None:
+            return
+        job = self.data.solver.submit(
+            expression.raw_string,
+            compiled.variables,
+            callback=self.wakeup.set,
+            mode="derivative",
+            payload=(compiled.parameter_name, compiled.solution_sources),
+        )
+        with self.lock:
+            previous = self.derivatives.get(expression)
+            self.derivatives[expression] = (expression.snapshot.generation, job)
+            self.start_thread()
+        if previous is not None:
+            previous[1].cancel(kill=False)
+        self.wakeup.set()
+
+    def start_thread(self):
+        if not self.running:
+            self.running = True
+            self.thread = threading.Thread(target=self.run, name="compute", daemon=True)
+            self.thread.start()
+
+    def cancel(self, expression: "UserExpression"):
+        expression.generation += 1
+        with self.lock:
+            self.pending.pop(expression, None)
+        self.wakeup.set()
+
+    def run(self):
+        while self.running:
+            self.wakeup.wait()
+            self.wakeup.clear()
+            with self.lock:
+                requests = list(self.pending.values())
+                self.pending.clear()
+            for request in requests:
+                self.start(request)
+            self.collect()
+            self.drop_stale()
+            self.collect_derivatives()
+
+    def start(self, request: ComputeRequest):
+        if request.stale:
+            return
+        if request.raw_string == "":
+            self.finish(request, None, None)
+            return
+        cache = self.data.compile_cache
+        request.key = cache.make_key(request.raw_string, self.data.vars_names)
+        compiled = cache.get(request.key)
+        if compiled is not None:
+            self.finish(request, compiled, None)
+            return
+        job = self.inflight.get(request.key)
+        if job is None or job.cancelled:
+            job = self.data.solver.submit(
+                request.raw_string, self.data.vars_names, callback=self.wakeup.set
+            )
+            self.inflight[request.key] = job
+        request.job = job
+        self.active.append(request)
+
+    def collect(self):
+        built: dict[SolveJob, CompiledExpression] = {}
+        fallbacks: dict[SolveJob, SolveJob] = {}
+        for request in list(self.active):
+            job = request.job
+            if not job.done.is_set():
+                continue
+            self.active.remove(request)
+            if self.inflight.get(request.key) is job:
+                self.inflight.pop(request.key)
+                self.data.profiler.add(
+                    f"solve ({job.mode})",
+                    job.started or job.finished,
+                    job.finished,
+                    thread="solver",
+                    args={"expression": job.raw_string},
+                )
+            result = job.result
+            if job.cancelled or result.get("cancelled"):
+                continue
+            if result.get("timeout") and job.mode == "solve":
+                if job not in fallbacks:
+                    fallbacks[job] = self.data.solver.submit(
+                        request.raw_string,
+                        self.data.vars_names,
+                        callback=self.wakeup.set,
+                        mode="implicit",
+                    )
+                    self.inflight[request.key] = fallbacks[job]
+                request.job = fallbacks[job]
+                self.active.append(request)
+                continue
+            if "error" in result:
+                self.finish(
+                    request, None, result["error"], result.get("dependencies", ())
+                )
+                continue
+            if job not in built:
+                try:
+                    built[job] = CompiledExpression.from_json(result)
+                except Exception as e:
+                    self.finish(request, None, str(e))
+                    continue
+                self.data.compile_cache.put(request.key, built[job])
+            self.finish(request, built[job], None)
+
+    def collect_derivatives(self):
+        with self.lock:
+            finished = [
+                (expression, generation, job)
+                for expression, (generation, job) in self.derivatives.items()
+                if job.done.is_set()
+            ]
+            for expression, _, _ in finished:
+                self.derivatives.pop(expression)
+        for expression, generation, job in finished:
+            self.data.profiler.add(
+                "derivative",
+                job.started or job.finished,
+                job.finished,
+                thread="solver",
+                args={"expression": job.raw_string},
+            )
+            if job.cancelled or job.result.get("cancelled"):
+                continue
+            if expression.snapshot.generation != generation:
+                continue
+            expression.publish_derivative(job.result, self.data)
+            self.data.idle.wake()
+
+    def drop_stale(self):
+        live_jobs = {request.job for request in self.active if not request.stale}
+        for request in list(self.active):
+            if not request.stale:
+                continue
+            self.active.remove(request)
+            if request.job not in live_jobs and not request.job.cancelled:
+                # workers are only killed for expressions that are gone, the
+                # deadline still bounds a stale solve left running
+                request.job.cancel(request.expression not in self.data.expressions)
+                if self.inflight.get(request.key) is request.job:
+                    self.inflight.pop(request.key)
+
+    def finish(self, request: ComputeRequest, compiled, error_reason, dependencies=()):
+        if request.speculative or request.stale:
+            return
+        with self.data.profiler.span("publish", {"expression": request.raw_string}):
+            request.expression.publish(
+                CompiledSnapshot(
+                    request.generation,
+                    request.raw_string,
+                    compiled,
+                    error_reason,
+                    dependencies,
+                ),
+                self.data,
+            )
+        self.data.idle.wake()
+
+    def shutdown(self):
+        self.running = False
+        self.wakeup.set()
@@ -0,0 +1,83 @@
+from .common import *
+
+if typing.TYPE_CHECKING:
+    from .bridge import PlotData, UserData, UserExpression
+
+
+def sample_curve(points, axis, data: "PlotData"):
+    samples = points[:, axis].astype(numpy.float64)
+    values = points[:, 1 - axis].astype(numpy.float64)
+    scale = data.czoom * data.unit
+    if axis == 0:
+        parameters = (samples - data.viewx / 2) / scale + data.cposx
+        world = -(values - data.viewy / 2) / scale + data.cposy
+    else:
+        parameters = -(samples - data.viewy / 2) / scale + data.cposy
+        world = (values - data.viewx / 2) / scale + data.cposx
+    slopes = numpy.full(len(points), numpy.nan)
+    if len(points) < 2:
+        return parameters, world, slopes
+    steps = numpy.diff(values)
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        # both screen axes share the scale and the vertical one is flipped
+        segments = -steps / numpy.diff(samples)
+    slopes[0] = segments[0]
+    slopes[-1] = segments[-1]
+    slopes[1:-1] = (segments[:-1] + segments[1:]) / 2
+    # a jump shows up as one step far larger than the step on its other side
+    steps = numpy.abs(steps)
+    big = steps > DERIVATIVE_JUMP_PIXELS
+    with numpy.errstate(invalid="ignore"):
+        sudden = (big[1:] & (steps[1:] > steps[:-1] * DERIVATIVE_JUMP_RATIO)) | (
+            big[:-1] & (steps[:-1] > steps[1:] * DERIVATIVE_JUMP_RATIO)
+        )
+    slopes[1:-1][sudden] = numpy.nan
+    if parameters[0] > parameters[-1]:
+        parameters, world, slopes = parameters[::-1], world[::-1], slopes[::-1]
+    return parameters, world, slopes
+
+
+def interpolate_sample(parameters, values, slopes, parameter):
+    i = int(numpy.searchsorted(parameters, parameter)) - 1
+    if i < 1 or i + 2 >= len(parameters):
+        return None, None
+    window = slice(i - 1, i + 3)
+    return (
+        interpolate_window(parameters[window], values[window], parameter),
+        interpolate_window(parameters[window], slopes[window], parameter),
+    )
+
+
+def interpolate_window(parameters, values, parameter):
+    p0, p1, p2, p3 = parameters
+    v0, v1, v2, v3 = values
+    if not p2 > p1:
+        return
+    result = v1 + (v2 - v1) * (parameter - p1) / (p2 - p1)
+    # how far the inner samples bend off their neighbours' chords bounds the error
+    bend = max(
+        abs(v1 - v0 - (v2 - v0) * (p1 - p0) / (p2 - p0)),
+        abs(v2 - v1 - (v3 - v1) * (p2 - p1) / (p3 - p1)),
+    )
+    if not bend / 4 <= HOVER_INTERPOLATION_TOLERANCE * max(1, abs(result)):
+        return
+    return float(result)
+
+
+class SampledDerivative:
+    def __init__(self, expression: "UserExpression", branch, data: "UserData"):
+        self.expression = expression
+        self.branch = branch
+        self.data = data
+
+    def __call__(self, parameter, *variables):
+        # the index of the frame on screen holds copies the render thread leaves alone
+        index = self.data.plot_index.axes.get((self.expression, self.branch))
+        if index is None:
+            return numpy.nan
+        parameters, _, slopes = index.sample()
+        if len(parameters) <= 0:
+            return numpy.nan
+        return numpy.interp(
+            parameter, parameters, slopes, left=numpy.nan, right=numpy.nan
+        )
@@ -0,0 +1,68 @@
+from .common import *
+import threading
+import time
+
+if typing.TYPE_CHECKING:
+    from .bridge import UserData
+
+
+class IdleScheduler:
+    def __init__(self, data: "UserData"):
+        self.data = data
+        self.last_activity = time.perf_counter()
+        self.period_start = self.last_activity
+        self.period_idle = 0
+        self.idle_ratio = 0
+        self.waiting = False
+        self.lock = threading.Lock()
+
+    @property
+    def busy(self):
+        data = self.data
+        return (
+            data.need_to_plot
+            or data.animation.playing
+            or data.profiler.recording
+            or data.renderer.busy
+            or data.renderer.fresh
+            or data.coordinator.busy
+            or len(data.coordinator.derivatives) > 0
+            or any(expression.editing for expression in data.expressions)
+        )
+
+    def activity(self):
+        self.last_activity = time.perf_counter()
+
+    def wake(self):
+        with self.lock:
+            if not self.waiting:
+                return
+            self.waiting = False
+        pygame.event.post(pygame.Event(IDLE_WAKE_EVENT))
+
+    def wait(self):
+        now = time.perf_counter()
+        if now - self.last_activity >= IDLE_DELAY / 1000:
+            # flag first so a thread finishing after the busy check still wakes us
+            with self.lock:
+                self.waiting = True
+            if not self.busy:
+                event = pygame.event.wait(IDLE_TIMEOUT)
+                # put the waking event back in front of whatever queued behind it
+                events = [
+                    event
+                    for event in [event, *pygame.event.get()]
+                    if event.type not in (pygame.NOEVENT, IDLE_WAKE_EVENT)
+                ]
+                for event in events:
+                    pygame.event.post(event)
+                if len(events) > 0:
+                    self.activity()
+            with self.lock:
+                self.waiting = False
+        end = time.perf_counter()
+        self.period_idle += end - now
+        if end - self.period_start >= IDLE_REPORT_PERIOD / 1000:
+            self.idle_ratio = self.period_idle / (end - self.period_start)
+            self.period_start = end
+            self.period_idle = 0
@@ -0,0 +1,199 @@
+from .common import *
+
+if typing.TYPE_CHECKING:
+    from .bridge import PlotData
+
+# edges: 0 top (a-b), 1 right (b-c), 2 bottom (d-c), 3 left (a-d)
+# case bits: a 1, b 2, c 4, d 8 (set when the corner is positive)
+SEGMENT_TABLE = numpy.array(
+    [
+        (-1, -1),
+        (0, 3),
+        (0, 1),
+        (3, 1),
+        (1, 2),
+        (-1, -1),
+        (0, 2),
+        (3, 2),
+        (3, 2),
+        (0, 2),
+        (-1, -1),
+        (1, 2),
+        (3, 1),
+        (0, 1),
+        (0, 3),
+        (-1, -1),
+    ]
+)
+SADDLE_SPLIT = numpy.array([(0, 1), (3, 2)]), numpy.array([(0, 3), (1, 2)])
+
+
+def evaluate_field(function, xs, ys, variables):
+    values = function(xs, ys, *variables)
+    if numpy.isscalar(values) or numpy.ndim(values) == 0:
+        return numpy.full(numpy.broadcast(xs, ys).shape, values, dtype=numpy.float64)
+    if numpy.iscomplexobj(values):
+        values = numpy.where(values.imag == 0, values.real, numpy.nan)
+    return numpy.broadcast_to(values, numpy.broadcast(xs, ys).shape)
+
+
+def crossing(corners):
+    finite = numpy.isfinite(corners).all(axis=-1)
+    low = numpy.min(corners, axis=-1)
+    high = numpy.max(corners, axis=-1)
+    return finite & (low <= 0) & (high > 0)
+
+
+def implicit_contour(function, data: "PlotData"):
+    scale = data.czoom * data.unit
+
+    def field(sx, sy):
+        xs = (sx - data.viewx / 2) / scale + data.cposx
+        ys = -(sy - data.viewy / 2) / scale + data.cposy
+        return evaluate_field(function, xs, ys, data.variables)
+
+    size = float(IMPLICIT_COARSE_PIXELS)
+    columns = int(numpy.ceil(data.viewx / size))
+    rows = int(numpy.ceil(data.viewy / size))
+    grid_x = numpy.arange(columns + 1) * size
+    grid_y = numpy.arange(rows + 1) * size
+    values = field(grid_x[None, :], grid_y[:, None])
+    # corners in a, b, c, d order: top left, top right, bottom right, bottom left
+    corners = numpy.stack(
+        [values[:-1, :-1], values[:-1, 1:], values[1:, 1:], values[1:, :-1]], axis=-1
+    )
+    active = crossing(corners)
+    cell_y, cell_x = numpy.nonzero(active)
+    x0 = grid_x[cell_x]
+    y0 = grid_y[cell_y]
+    corners = corners[active]
+
+    offsets = numpy.array([0, 1, 2])
+    while size > IMPLICIT_MIN_PIXEL and len(x0) * 4 <= IMPLICIT_MAX_CELLS:
+        size /= 2
+        lattice = field(
+            x0[:, None, None] + offsets[None, None, :] * size,
+            y0[:, None, None] + offsets[None, :, None] * size,
+        )
+        children = numpy.stack(
+            [
+                lattice[:, j : j + 2, i : i + 2].reshape(-1, 4)[:, [0, 1, 3, 2]]
+                for j in (0, 1)
+                for i in (0, 1)
+            ],
+            axis=1,
+        )
+        child_x = x0[:, None] + numpy.array([0, 1, 0, 1]) * size
+        child_y = y0[:, None] + numpy.array([0, 0, 1, 1]) * size
+        keep = crossing(children)
+        x0 = child_x[keep]
+        y0 = child_y[keep]
+        corners = children[keep]
+
+    if len(x0) <= 0:
+        return []
+    center = field(x0 + size / 2, y0 + size / 2)
+    # a pole flips the sign without passing through zero and blows up inside
+    continuous = numpy.abs(center) <= numpy.max(numpy.abs(corners), axis=-1) * 2
+    x0, y0, corners, center = (
+        x0[continuous],
+        y0[continuous],
+        corners[continuous],
+        center[continuous],
+    )
+    return stitch(*march(x0, y0, size, corners, center))
+
+
+def march(x0, y0, size, corners, center):
+    a, b, c, d = corners[:, 0], corners[:, 1], corners[:, 2], corners[:, 3]
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        edges = numpy.stack(
+            [
+                numpy.column_stack((x0 + size * a / (a - b), y0)),
+                numpy.column_stack((x0 + size, y0 + size * b / (b - c))),
+                numpy.column_stack((x0 + size * d / (d - c), y0 + size)),
+                numpy.column_stack((x0, y0 + size * a / (a - d))),
+            ],
+            axis=1,
+        )
+    # neighbouring cells share an edge key, which is what stitch joins on
+    column = numpy.rint(x0 / size).astype(numpy.int64)
+    row = numpy.rint(y0 / size).astype(numpy.int64)
+    width = column.max() + 2
+    keys = numpy.stack(
+        [
+            (row * width + column) * 2,
+            (row * width + column + 1) * 2 + 1,
+            ((row + 1) * width + column) * 2,
+            (row * width + column) * 2 + 1,
+        ],
+        axis=1,
+    )
+    case = (a > 0) * 1 + (b > 0) * 2 + (c > 0) * 4 + (d > 0) * 8
+    pairs = SEGMENT_TABLE[case]
+    rows = numpy.arange(len(case))
+    plain = pairs[:, 0] >= 0
+    segments = [edges[rows, pairs[:, 0]][plain], edges[rows, pairs[:, 1]][plain]]
+    segment_keys = [keys[rows, pairs[:, 0]][plain], keys[rows, pairs[:, 1]][plain]]
+
+    saddle = (case == 5) | (case == 10)
+    if numpy.any(saddle):
+        # the sign at the center decides which opposite corners are connected
+        joined = (case[saddle] == 5) == (center[saddle] > 0)
+        split = numpy.where(joined[:, None, None], *SADDLE_SPLIT)
+        saddle_edges = edges[saddle]
+        saddle_keys = keys[saddle]
+        saddle_rows = numpy.arange(len(saddle_edges))[:, None]
+        for end in (0, 1):
+            segments[end] = numpy.concatenate(
+                [
+                    segments[end],
+                    saddle_edges[saddle_rows, split[:, :, end]].reshape(-1, 2),
+                ]
+            )
+            segment_keys[end] = numpy.concatenate(
+                [
+                    segment_keys[end],
+                    saddle_keys[saddle_rows, split[:, :, end]].reshape(-1),
+                ]
+            )
+    return segments, segment_keys
+
+
+def stitch(segments, segment_keys):
+    count = len(segments[0])
+    if count <= 0:
+        return []
+    points = numpy.concatenate(segments)
+    keys = numpy.concatenate(segment_keys)
+    # an edge belongs to at most two cells, so every endpoint has at most one partner
+    order = numpy.argsort(keys, kind="stable")
+    same = keys[order[1:]] == keys[order[:-1]]
+    partner = numpy.full(count * 2, -1)
+    partner[order[:-1][same]] = order[1:][same]
+    partner[order[1:][same]] = order[:-1][same]
+    partner = partner.tolist()
+    visited = bytearray(count)
+
+    def walk(end):
+        path = []
+        while True:
+            other = partner[end]
+            if other < 0 or visited[other % count]:
+                return path
+            visited[other % count] = 1
+            end = (other + count) % (count * 2)
+            path.append(end)
+
+    polylines = []
+    for segment in range(count):
+        if visited[segment]:
+            continue
+        visited[segment] = 1
+        forward = walk(segment + count)
+        backward = walk(segment)
+        chain = backward[::-1] + [segment, segment + count] + forward
+        if partner[chain[-1]] == chain[0]:
+            chain.append(chain[0])
+        polylines.append(points[chain])
+    return polylines
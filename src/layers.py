@@ -0,0 +1,156 @@
+from .common import *
+import collections
+import threading
+
+
+class TextCache:
+    def __init__(self, capacity=TEXT_CACHE_SIZE):
+        self.capacity = capacity
+        self.entries: collections.OrderedDict[tuple, pygame.Surface] = (
+            collections.OrderedDict()
+        )
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        if total == 0:
+            return 0
+        return self.hits / total
+
+    def render(self, font: pygame.Font, size, text, color):
+        key = (text, size, tuple(pygame.Color(color)))
+        with self.lock:
+            surface = self.entries.get(key)
+            if surface is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return surface
+            self.misses += 1
+            surface = font.render(text, True, color)
+            self.entries[key] = surface
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+            return surface
+
+    def render_uncached(self, font: pygame.Font, text, color):
+        with self.lock:
+            return font.render(text, True, color)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class GridLayer:
+    def __init__(self):
+        self.column: pygame.Surface = None
+        self.row: pygame.Surface = None
+        self.columns: numpy.ndarray = None
+        self.rows: numpy.ndarray = None
+        self.key = None
+        self.builds = 0
+
+    def build(self, view, cell_w):
+        width = int(view[0]) + 1
+        height = int(view[1]) + 1
+        self.column = pygame.Surface((1, height))
+        self.column.fill(GRID_COL)
+        self.row = pygame.Surface((width, 1))
+        self.row.fill(GRID_COL)
+        # enough lines for the smallest cell of the bucket and one left of the view
+        self.columns = numpy.arange(int(numpy.ceil(width / cell_w)) + 2)
+        self.rows = numpy.arange(int(numpy.ceil(height / cell_w)) + 2)
+        self.builds += 1
+
+    def draw(self, screen: pygame.Surface, view, cell_w, world_cell, startx, starty):
+        # one layer per zoom bucket, zooming within it only moves the lines
+        level = int(numpy.floor(numpy.log2(cell_w) * GRID_ZOOM_STEPS))
+        key = (int(view[0]), int(view[1]), world_cell, level)
+        if key != self.key:
+            self.build(view, 2 ** (level / GRID_ZOOM_STEPS))
+            self.key = key
+        xs = numpy.floor(startx % cell_w - cell_w + self.columns * cell_w)
+        ys = numpy.floor(starty % cell_w - cell_w + self.rows * cell_w)
+        screen.fill("black")
+        screen.blits(
+            [(self.column, (x, 0)) for x in xs[xs < view[0]].astype(int).tolist()]
+            + [(self.row, (0, y)) for y in ys[ys < view[1]].astype(int).tolist()],
+            doreturn=False,
+        )
+
+    def clear(self):
+        self.column = None
+        self.row = None
+        self.columns = None
+        self.rows = None
+        self.key = None
+
+
+class AreaLayer:
+    def __init__(self):
+        self.surface: pygame.Surface = None
+        self.fill = numpy.empty((0, 0), dtype=bool)
+        self.scratch = numpy.empty((0, 0), dtype=bool)
+        self.lines = numpy.empty(0, dtype=numpy.int32)
+
+    def resize(self, size):
+        if self.surface is not None and self.surface.size == size:
+            return
+        self.surface = pygame.Surface(size, pygame.SRCALPHA)
+        # row major like the surface memory, so pixel writes stay contiguous
+        self.fill = numpy.empty((size[1], size[0]), dtype=bool)
+        self.scratch = numpy.empty((size[1], size[0]), dtype=bool)
+        self.lines = numpy.arange(max(size), dtype=numpy.int32)
+
+    def spans(self, points, axis, count, zero, extent):
+        samples = points[:, axis]
+        values = points[:, 1 - axis]
+        if len(samples) > 1 and samples[0] > samples[-1]:
+            samples, values = samples[::-1], values[::-1]
+        # a NaN sample on either side of a pixel line leaves it empty, so gaps
+        # between separate regions are never bridged
+        curve = numpy.interp(
+            numpy.arange(count) + 0.5, samples, values, left=numpy.nan, right=numpy.nan
+        )
+        curve[numpy.isnan(curve)] = zero
+        start = numpy.clip(numpy.ceil(numpy.minimum(curve, zero) - 0.5), 0, extent)
+        end = numpy.clip(numpy.ceil(numpy.maximum(curve, zero) - 0.5), 0, extent)
+        return start.astype(numpy.int32), end.astype(numpy.int32)
+
+    def draw(self, screen: pygame.Surface, points, axis, zero, color):
+        if len(points) <= 1:
+            return
+        size = screen.size
+        self.resize(size)
+        start, end = self.spans(points, axis, size[axis], zero, size[1 - axis])
+        low, high = int(start.min()), int(end.max())
+        if high <= low:
+            return
+        # only the band between the lowest and highest span is touched
+        lines = self.lines[low:high]
+        if axis == 0:
+            band = (slice(low, high), slice(None))
+            lines, start, end = lines[:, None], start[None, :], end[None, :]
+            rect = pygame.Rect(0, low, size[0], high - low)
+        else:
+            band = (slice(None), slice(low, high))
+            lines, start, end = lines[None, :], start[:, None], end[:, None]
+            rect = pygame.Rect(low, 0, high - low, size[1])
+        fill = self.fill[band]
+        scratch = self.scratch[band]
+        numpy.greater_equal(lines, start, out=fill)
+        numpy.less(lines, end, out=scratch)
+        fill &= scratch
+        color = pygame.Color(color)
+        # map_rgb returns a signed int, the pixel array is unsigned
+        value = self.surface.map_rgb((color.r, color.g, color.b, AREA_ALPHA))
+        pixels = pygame.surfarray.pixels2d(self.surface)
+        numpy.multiply(fill, numpy.uint32(value & 0xFFFFFFFF), out=pixels.T[band])
+        del pixels
+        screen.blit(self.surface, rect, rect)
+
+    def clear(self):
+        self.surface = None
@@ -0,0 +1,143 @@
+from .common import *
+
+
+def decimate_columns(points, width, axis=0):
+    count = len(points)
+    if count <= DECIMATE_FACTOR * width:
+        return points
+    coords = points[:, axis]
+    values = points[:, 1 - axis]
+    invalid = numpy.isnan(coords) | numpy.isnan(values)
+    columns = numpy.floor(numpy.where(invalid, 0, coords))
+    change = numpy.empty(count, dtype=bool)
+    change[0] = True
+    change[1:] = (invalid[1:] != invalid[:-1]) | (
+        ~invalid[1:] & (columns[1:] != columns[:-1])
+    )
+    starts = numpy.flatnonzero(change)
+    ends = numpy.append(starts[1:], count) - 1
+    groups = numpy.cumsum(change) - 1
+    indices = numpy.arange(count)
+
+    safe_values = numpy.where(invalid, 0, values)
+    group_min = numpy.minimum.reduceat(safe_values, starts)
+    group_max = numpy.maximum.reduceat(safe_values, starts)
+    argmin = numpy.minimum.reduceat(
+        numpy.where(safe_values == group_min[groups], indices, count), starts
+    )
+    argmax = numpy.minimum.reduceat(
+        numpy.where(safe_values == group_max[groups], indices, count), starts
+    )
+    valid_groups = ~invalid[starts]
+    keep = numpy.unique(
+        numpy.concatenate(
+            [
+                starts,
+                ends[valid_groups],
+                argmin[valid_groups],
+                argmax[valid_groups],
+            ]
+        )
+    )
+    return points[keep]
+
+
+def clip_segments(starts, ends, low, high):
+    t0 = numpy.zeros(len(starts[0]))
+    t1 = numpy.ones(len(starts[0]))
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        for p, end, lo, hi in zip(starts, ends, low, high):
+            d = end - p
+            to_low = (lo - p) / d
+            to_high = (hi - p) / d
+            rising = d > 0
+            enter = numpy.where(rising, to_low, to_high)
+            leave = numpy.where(rising, to_high, to_low)
+            parallel = d == 0
+            enter[parallel] = -numpy.inf
+            leave[parallel] = numpy.inf
+            leave[parallel & ((p < lo) | (p > hi))] = -numpy.inf
+            numpy.maximum(t0, enter, out=t0)
+            numpy.minimum(t1, leave, out=t1)
+    return t0, t1
+
+
+def discontinuities(values, low, high):
+    # a pole jumps from one side of the view to the other against the local trend
+    first, second = values[:-1], values[1:]
+    jumps = numpy.flatnonzero(
+        ((first < low) & (second > high)) | ((first > high) & (second < low))
+    )
+    if len(jumps) <= 0:
+        return jumps
+    padded = numpy.concatenate(([numpy.nan], values, [numpy.nan]))
+    before = numpy.sign(padded[jumps + 1] - padded[jumps])
+    trend = numpy.sign(padded[jumps + 2] - padded[jumps + 1])
+    after = numpy.sign(padded[jumps + 3] - padded[jumps + 2])
+    return jumps[(trend != before) & (trend != after)]
+
+
+def axis_span(points, axis, low, high):
+    coords = points[:, axis]
+    if len(coords) < 2 or not numpy.all(coords[1:] >= coords[:-1]):
+        return points
+    start = max(int(numpy.searchsorted(coords, low, "left")) - 1, 0)
+    end = int(numpy.searchsorted(coords, high, "right")) + 1
+    return points[start:end]
+
+
+def visible_runs(points, view, axis=None, margin=POLYLINE_CLIP_MARGIN, clip=None):
+    if len(points) < 2:
+        return []
+    low = (-margin, -margin)
+    high = (view[0] + margin, view[1] + margin)
+    if clip is not None:
+        low = (clip.left - margin, clip.top - margin)
+        high = (clip.right + margin, clip.bottom + margin)
+    # far away endpoints are pulled in first so interpolation stays exact near the view
+    limit = max(view[0], view[1]) * POLYLINE_CLIP_LIMIT
+    # columns are handled separately, reductions over the short axis are slow
+    columns = [points[:, 0], points[:, 1]]
+    keep = numpy.ones(len(points) - 1, dtype=bool)
+    inside = numpy.ones(len(points), dtype=bool)
+    for c in (0, 1):
+        finite = numpy.isfinite(columns[c])
+        keep &= finite[:-1]
+        keep &= finite[1:]
+        inside &= columns[c] >= low[c]
+        inside &= columns[c] <= high[c]
+        columns[c] = numpy.clip(columns[c], -limit, limit).astype(
+            numpy.float64, copy=False
+        )
+    if axis is not None:
+        value = 1 - axis
+        keep[discontinuities(points[:, value], low[value], high[value])] = False
+    starts = [column[:-1] for column in columns]
+    ends = [column[1:] for column in columns]
+    t0 = numpy.zeros(len(keep))
+    t1 = numpy.ones(len(keep))
+    # only segments leaving the view need to be clipped
+    edges = numpy.flatnonzero(keep & ~(inside[:-1] & inside[1:]))
+    t0[edges], t1[edges] = clip_segments(
+        [start[edges] for start in starts], [end[edges] for end in ends], low, high
+    )
+    keep[edges] &= t0[edges] <= t1[edges]
+    segments = numpy.flatnonzero(keep)
+    if len(segments) <= 0:
+        return []
+    # a run continues only through shared points that are on screen
+    new_run = numpy.ones(len(segments), dtype=bool)
+    new_run[1:] = (segments[1:] != segments[:-1] + 1) | ~inside[segments[1:]]
+    run_starts = numpy.flatnonzero(new_run)
+    positions = numpy.arange(len(segments)) + numpy.cumsum(new_run) - 1
+    output = numpy.empty((len(segments) + len(run_starts), 2))
+    first = segments[run_starts]
+    clipped = numpy.flatnonzero(t1[segments] < 1)
+    last = segments[clipped]
+    for start, end, out in zip(starts, ends, output.T):
+        out[positions[run_starts]] = start[first] + t0[first] * (
+            end[first] - start[first]
+        )
+        out[positions + 1] = end[segments]
+        out[positions[clipped] + 1] = start[last] + t1[last] * (end[last] - start[last])
+    return numpy.split(output, positions[run_starts[1:]])
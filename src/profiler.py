@@ -0,0 +1,134 @@
+from .common import *
+import collections
+import contextlib
+import datetime
+import json
+import os
+import sys
+import threading
+import time
+
+
+class Profiler:
+    def __init__(self):
+        self.overlay = False
+        self.origin = time.perf_counter()
+        self.phases: dict[str, collections.deque] = {}
+        self.frame_phases: collections.defaultdict[str, float] = (
+            collections.defaultdict(float)
+        )
+        self.frame_start = None
+        self.frame_blocks = sys.getallocatedblocks()
+        # blocks still alive at the end of a frame minus those at its start,
+        # memory allocated and freed within the frame does not show up here
+        self.net_blocks: collections.deque = collections.deque(maxlen=PROFILER_WINDOW)
+        self.recording = False
+        self.record_end = 0
+        self.events = []
+        self.threads: dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    @property
+    def active(self):
+        return self.overlay or self.recording
+
+    @contextlib.contextmanager
+    def span(self, name, args=None):
+        if not self.active:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, start, time.perf_counter(), args=args)
+
+    def add(self, name, start, end, thread=None, args=None):
+        if not self.active:
+            return
+        with self.lock:
+            if thread is None:
+                thread = threading.current_thread().name
+            tid = self.threads.setdefault(thread, len(self.threads) + 1)
+            if thread == threading.main_thread().name:
+                self.frame_phases[name] += end - start
+            else:
+                self.phases.setdefault(
+                    name, collections.deque(maxlen=PROFILER_WINDOW)
+                ).append(end - start)
+            if self.recording:
+                event = {
+                    "name": name,
+                    "ph": "X",
+                    "ts": (start - self.origin) * 1e6,
+                    "dur": (end - start) * 1e6,
+                    "pid": os.getpid(),
+                    "tid": tid,
+                }
+                if args is not None:
+                    event["args"] = args
+                self.events.append(event)
+
+    def frame(self):
+        now = time.perf_counter()
+        blocks = sys.getallocatedblocks()
+        if self.frame_start is not None and self.active:
+            with self.lock:
+                self.frame_phases["frame"] = now - self.frame_start
+                for name, duration in self.frame_phases.items():
+                    self.phases.setdefault(
+                        name, collections.deque(maxlen=PROFILER_WINDOW)
+                    ).append(duration)
+                self.frame_phases.clear()
+            self.net_blocks.append(blocks - self.frame_blocks)
+            if self.recording:
+                self.add("frame", self.frame_start, now)
+        self.frame_start = now
+        self.frame_blocks = blocks
+        if self.recording and now >= self.record_end:
+            self.stop_recording()
+
+    def record(self, seconds=PROFILER_RECORD_SECONDS):
+        if self.recording:
+            return
+        with self.lock:
+            self.events = []
+            self.recording = True
+            self.record_end = time.perf_counter() + seconds
+
+    def stop_recording(self):
+        with self.lock:
+            self.recording = False
+            events = self.events
+            self.events = []
+            threads = dict(self.threads)
+        metadata = [
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": os.getpid(),
+                "tid": tid,
+                "args": {"name": name},
+            }
+            for name, tid in threads.items()
+        ]
+        stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        path = os.path.join(PROFILER_TRACE_DIR, f"trace-{stamp}.json")
+        try:
+            os.makedirs(PROFILER_TRACE_DIR, exist_ok=True)
+            with open(path, "w") as file:
+                json.dump({"traceEvents": metadata + events}, file)
+            print(f"Trace written to {path}")
+        except OSError as e:
+            print(f"ERROR: {e}")
+        return path
+
+    def summary(self):
+        with self.lock:
+            phases = {
+                name: (numpy.mean(samples) * 1000, numpy.max(samples) * 1000)
+                for name, samples in self.phases.items()
+                if len(samples) > 0
+            }
+        net_blocks = numpy.mean(self.net_blocks) if len(self.net_blocks) > 0 else 0
+        return phases, net_blocks
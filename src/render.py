@@ -0,0 +1,201 @@
+from .common import *
+import threading
+
+if typing.TYPE_CHECKING:
+    from .bridge import UserData
+    from .spatial import PlotIndex
+
+
+class RenderFrame:
+    def __init__(self, data: "UserData", size):
+        # the render thread works from this copy while the UI keeps changing data
+        self.size = (int(size[0]), int(size[1]))
+        self.view = pygame.Vector2(self.size)
+        self.cpos = pygame.Vector2(data.cpos)
+        self.czoom = data.czoom
+        self.unit = data.unit
+        self.precision = data.precision
+        self.adaptive_sampling = data.adaptive_sampling
+        self.tiled_sampling = data.tiled_sampling
+        self.float32_plotting = data.float32_plotting
+        self.coarse_stride = data.coarse_stride
+        self.vars_names = list(data.vars_names)
+        self.vars_values = list(data.vars_values)
+        self.expressions = list(data.expressions)
+        self.scene = data.scene_version
+        self.camera = (self.cpos.x, self.cpos.y, self.czoom, self.unit, self.size)
+
+
+class RenderWorker:
+    def __init__(self, data: "UserData"):
+        self.data = data
+        self.display = pygame.Surface((10, 10), pygame.SRCALPHA)
+        self.ready: pygame.Surface = None
+        self.back: pygame.Surface = None
+        # grid and curves without labels, the part of a frame that scrolls
+        self.layer: pygame.Surface = None
+        self.last_layer: pygame.Surface = None
+        self.fresh = False
+        self.frame: RenderFrame = None
+        self.requested = 0
+        self.rendered = 0
+        self.skipped = 0
+        self.presented_time = 0
+        self.frames: dict[pygame.Surface, tuple[RenderFrame, "PlotIndex"]] = {}
+        self.last: pygame.Surface = None
+        self.partial = False
+        self.stride = 1
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.running = False
+
+    @property
+    def busy(self):
+        return self.requested != self.rendered or self.stride > 1
+
+    def request(self, size):
+        frame = RenderFrame(self.data, size)
+        with self.lock:
+            self.frame = frame
+            self.requested += 1
+            if not self.running:
+                self.running = True
+                self.thread = threading.Thread(
+                    target=self.run, name="render", daemon=True
+                )
+                self.thread.start()
+        self.wakeup.set()
+
+    def present(self):
+        with self.lock:
+            if self.fresh:
+                self.display, self.ready = self.ready, self.display
+                self.fresh = False
+            presented = self.frames.get(self.display)
+            if presented is None:
+                return self.display, None
+            # hover queries the index of the frame on screen, not the one being drawn
+            frame, self.data.plot_index = presented
+            return self.display, frame.camera
+
+    def stale(self, generation):
+        if generation == self.requested:
+            return False
+        elapsed = pygame.time.get_ticks() - self.presented_time
+        return elapsed < RENDER_MAX_LATENCY
+
+    def run(self):
+        while self.running:
+            unfinished = self.partial or self.stride > 1
+            timeout = RENDER_SETTLE_DELAY / 1000 if unfinished else None
+            settled = not self.wakeup.wait(timeout)
+            self.wakeup.clear()
+            # the camera stopped, redraw what scrolling left behind and fill in
+            # the samples the coarse pass skipped, a frame per refinement
+            while settled and self.running and (self.partial or self.stride > 1):
+                with self.lock:
+                    generation = self.requested
+                    frame = self.frame
+                if generation != self.rendered:
+                    break
+                self.render(generation, frame, True, self.stride // PROGRESSIVE_FACTOR)
+            while self.running:
+                with self.lock:
+                    generation = self.requested
+                    frame = self.frame
+                if generation == self.rendered:
+                    break
+                self.render(generation, frame)
+
+    def render(self, generation, frame: RenderFrame, full=False, stride=None):
+        if stride is None:
+            stride = frame.coarse_stride
+        stride = max(stride, 1)
+        if self.back is None or self.back.size != frame.size:
+            self.back = pygame.Surface(frame.size, pygame.SRCALPHA)
+        if self.layer is None or self.layer.size != frame.size:
+            self.layer = pygame.Surface(frame.size, pygame.SRCALPHA)
+        offset = None
+        try:
+            crange, index, stride = self.data.prepare(frame, stride)
+            if self.stale(generation):
+                self.skipped += 1
+                return
+            if not full:
+                offset = self.scroll_offset(frame)
+            if offset is None:
+                self.data.draw(self.layer, crange, frame)
+            else:
+                self.scroll(offset, crange, frame)
+            self.back.fill(0)
+            self.back.blit(self.layer, (0, 0), special_flags=pygame.BLEND_RGBA_ADD)
+            self.data.draw_labels(self.back, crange, frame)
+        except Exception as e:
+            print(f"ERROR: {e}")
+            # a half drawn back buffer never reaches the screen
+            with self.lock:
+                self.stride = 1
+                self.partial = False
+                self.rendered = generation
+            return
+        with self.lock:
+            self.back, self.ready = self.ready, self.back
+            self.frames = {
+                surface: self.frames[surface]
+                for surface in (self.display, self.back)
+                if surface in self.frames
+            }
+            self.frames[self.ready] = (frame, index)
+            self.last = self.ready
+            self.partial = offset is not None
+            self.stride = stride
+            self.fresh = True
+            self.rendered = generation
+            self.presented_time = pygame.time.get_ticks()
+        self.layer, self.last_layer = self.last_layer, self.layer
+        self.data.idle.wake()
+
+    def scroll_offset(self, frame: RenderFrame):
+        previous = self.frames.get(self.last)
+        if previous is None or frame.scene != previous[0].scene:
+            return
+        camera = frame.camera
+        x, y, zoom, unit, size = previous[0].camera
+        if (zoom, unit, size) != camera[2:]:
+            return
+        scale = zoom * unit
+        dx = (x - camera[0]) * scale
+        dy = (camera[1] - y) * scale
+        # only whole pixel moves can be scrolled without resampling
+        if max(abs(dx - round(dx)), abs(dy - round(dy))) > RENDER_SCROLL_EPSILON:
+            return
+        dx, dy = round(dx), round(dy)
+        if abs(dx) >= size[0] or abs(dy) >= size[1]:
+            return
+        return dx, dy
+
+    def scroll(self, offset, crange, frame: RenderFrame):
+        dx, dy = offset
+        width, height = self.layer.size
+        self.layer.fill(0)
+        self.layer.blit(self.last_layer, offset, special_flags=pygame.BLEND_RGBA_ADD)
+        strips = []
+        if dx > 0:
+            strips.append(pygame.Rect(0, 0, dx, height))
+        elif dx < 0:
+            strips.append(pygame.Rect(width + dx, 0, -dx, height))
+        if dy > 0:
+            strips.append(pygame.Rect(0, 0, width, dy))
+        elif dy < 0:
+            strips.append(pygame.Rect(0, height + dy, width, -dy))
+        for strip in strips:
+            self.layer.set_clip(strip)
+            self.data.draw(self.layer, crange, frame, strip)
+        self.layer.set_clip(None)
+
+    def shutdown(self):
+        self.running = False
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join(1)
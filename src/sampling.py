@@ -0,0 +1,86 @@
+from .common import *
+
+
+class EvaluationBudget:
+    def __init__(self, total, consumers):
+        self.remaining = total
+        self.consumers = max(consumers, 1)
+
+    def claim(self):
+        share = self.remaining // self.consumers
+        self.consumers = max(self.consumers - 1, 1)
+        return share
+
+    def spend(self, amount):
+        self.remaining = max(self.remaining - amount, 0)
+
+
+def evaluate(function, xs, variables):
+    ys = function(xs, *variables)
+    if numpy.isscalar(ys) or numpy.ndim(ys) == 0:
+        return numpy.full_like(xs, ys, dtype=numpy.result_type(xs, numpy.float32))
+    if numpy.iscomplexobj(ys):
+        ys = numpy.where(ys.imag == 0, ys.real, numpy.nan)
+    return ys
+
+
+def adaptive_sample(
+    function,
+    start,
+    stop,
+    variables,
+    to_screen,
+    pixels,
+    budget: EvaluationBudget = None,
+    tolerance=ADAPTIVE_TOLERANCE,
+):
+    allowance = numpy.inf if budget is None else budget.claim()
+    coarse = max(int(pixels / ADAPTIVE_COARSE_PIXELS), 2) + 1
+    xs = numpy.linspace(start, stop, coarse)
+    ys = evaluate(function, xs, variables)
+    used = coarse
+    min_width = abs(stop - start) * ADAPTIVE_MIN_PIXEL / max(pixels, 1)
+    active = numpy.ones(coarse - 1, dtype=bool)
+    while True:
+        candidates = numpy.flatnonzero(active)
+        available = allowance - used
+        if len(candidates) <= 0 or available <= 0:
+            break
+        if len(candidates) > available:
+            sx, sy = to_screen(xs, ys)
+            lengths = numpy.hypot(
+                sx[candidates + 1] - sx[candidates],
+                sy[candidates + 1] - sy[candidates],
+            )
+            lengths[~numpy.isfinite(lengths)] = numpy.inf
+            keep = numpy.argpartition(-lengths, int(available) - 1)[: int(available)]
+            candidates = numpy.sort(candidates[keep])
+        left, right = candidates, candidates + 1
+        mids = (xs[left] + xs[right]) / 2
+        ym = evaluate(function, mids, variables)
+        used += len(mids)
+
+        sx0, sy0 = to_screen(xs[left], ys[left])
+        sx1, sy1 = to_screen(xs[right], ys[right])
+        sxm, sym = to_screen(mids, ym)
+        deviation = numpy.hypot(sxm - (sx0 + sx1) / 2, sym - (sy0 + sy1) / 2)
+        finite_left = numpy.isfinite(ys[left])
+        finite_right = numpy.isfinite(ys[right])
+        finite_mid = numpy.isfinite(ym)
+        refine = (
+            (deviation > tolerance)
+            | (finite_left != finite_mid)
+            | (finite_right != finite_mid)
+        )
+        refine &= numpy.abs(xs[right] - xs[left]) / 2 > min_width
+
+        xs = numpy.insert(xs, right, mids)
+        ys = numpy.insert(ys, right, ym)
+        repeats = numpy.ones(len(active), dtype=int)
+        repeats[candidates] = 2
+        flags = numpy.zeros(len(active), dtype=bool)
+        flags[candidates] = refine
+        active = numpy.repeat(flags, repeats)
+    if budget is not None:
+        budget.spend(used)
+    return xs, ys
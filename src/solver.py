@@ -0,0 +1,371 @@
+from .common import *
+from .cache import numpy_function_source
+import multiprocessing
+import multiprocessing.connection
+import collections
+import itertools
+import threading
+import time
+
+
+def symbol_names(*expressions):
+    names = set()
+    for expression in expressions:
+        names |= {symbol.name for symbol in expression.free_symbols}
+    return sorted(names - {"x", "y"})
+
+
+def evaluate_error(expression, vars_names):
+    # symbols that are not arguments are variables the user has not defined yet
+    if len(set(symbol_names(expression)) - set(vars_names)) > 0:
+        return "Expression uses undefined variables!"
+    return f"Cannot evaluate '{expression}' with numpy"
+
+
+def solve_expression(raw_string, vars_names):
+    raw_str = raw_string.replace("^", "**")
+    x, y = sympy.symbols("x,y")
+    vars_symbols = [sympy.Symbol(name, real=True) for name in vars_names]
+    solve_for = y
+    parameter = x
+    kind = "x"
+    try:
+        if "=" in raw_str:
+            raw_left, raw_right = raw_str.split("=", 1)
+            if raw_left.strip() == "x":
+                solve_for = x
+                parameter = y
+                kind = "y"
+            lefte = sympy.sympify(raw_left)
+            righte = sympy.sympify(raw_right)
+            solutions = sympy.solve(sympy.Equality(lefte, righte), solve_for)
+        else:
+            raw_right = raw_str.strip()
+            if "y" in raw_right:
+                solve_for = x
+                parameter = y
+                kind = "y"
+            solutions = sympy.solve(
+                sympy.Equality(sympy.sympify(solve_for.name), sympy.sympify(raw_right)),
+                solve_for,
+            )
+    except Exception as e:
+        return implicit_fallback(raw_string, vars_names, str(e))
+
+    functions = []
+    for solution in solutions:
+        try:
+            func = sympy.lambdify([parameter, *vars_symbols], solution, "numpy")
+        except Exception as e:
+            return implicit_fallback(raw_string, vars_names, str(e))
+        source = numpy_function_source(func)
+        if source is None:
+            return implicit_fallback(
+                raw_string, vars_names, evaluate_error(solution, vars_names)
+            )
+        functions.append(source)
+    if len(functions) <= 0:
+        return implicit_fallback(
+            raw_string, vars_names, "The expression has no solutions"
+        )
+    return {
+        "kind": kind,
+        "parameter": parameter.name,
+        "variables": list(vars_names),
+        "dependencies": symbol_names(*solutions),
+        "solutions": [sympy.srepr(solution) for solution in solutions],
+        "functions": functions,
+    }
+
+
+def implicit_expression(raw_string, vars_names):
+    raw_str = raw_string.replace("^", "**")
+    x, y = sympy.symbols("x,y")
+    vars_symbols = [sympy.Symbol(name, real=True) for name in vars_names]
+    try:
+        if "=" in raw_str:
+            raw_left, raw_right = raw_str.split("=", 1)
+            field = sympy.sympify(raw_left) - sympy.sympify(raw_right)
+        else:
+            raw_right = raw_str.strip()
+            solve_for = x if "y" in raw_right else y
+            field = solve_for - sympy.sympify(raw_right)
+        func = sympy.lambdify([x, y, *vars_symbols], field, "numpy")
+    except Exception as e:
+        return {"error": str(e)}
+    dependencies = symbol_names(field)
+    if len(field.free_symbols & {x, y}) <= 0:
+        return {"error": "The expression has no solutions"}
+    source = numpy_function_source(func)
+    if source is None:
+        # usually an undefined variable, defining it has to recompile this
+        return {
+            "error": evaluate_error(field, vars_names),
+            "dependencies": dependencies,
+        }
+    return {
+        "kind": "implicit",
+        "parameter": x.name,
+        "variables": list(vars_names),
+        "dependencies": dependencies,
+        "solutions": [sympy.srepr(field)],
+        "functions": [source],
+    }
+
+
+def implicit_fallback(raw_string, vars_names, error_reason):
+    result = implicit_expression(raw_string, vars_names)
+    if "error" in result:
+        return {"error": error_reason, "dependencies": result.get("dependencies", [])}
+    return result
+
+
+def derivative_entry(solution, parameter, vars_symbols):
+    # anything that cannot be differentiated into plain numpy code is left to
+    # the numeric derivative computed from the plotted samples
+    if isinstance(solution, sympy.Abs):
+        inside = solution.args[0]
+        parts = {
+            "inside": inside,
+            "right": sympy.diff(inside, parameter),
+            "left": sympy.diff(-inside, parameter),
+        }
+    elif isinstance(solution, sympy.sign):
+        parts = {"derivative": sympy.Number(0)}
+    else:
+        for function, name in [
+            (sympy.floor, "floor"),
+            (sympy.ceiling, "ceil"),
+            (sympy.sign, "sign"),
+            (sympy.Abs, "abs"),
+        ]:
+            if solution.has(function):
+                return {"numeric": f"Symbolic derivative unavailable for '{name}'"}
+        parts = {"derivative": sympy.diff(solution, parameter)}
+    entry = {}
+    for name, part in parts.items():
+        if part.has(sympy.Derivative):
+            return {"numeric": f"Cannot differentiate '{solution}'"}
+        func = sympy.lambdify([parameter, *vars_symbols], part, "numpy")
+        source = numpy_function_source(func)
+        if source is None:
+            return {"numeric": f"Cannot evaluate '{part}' with numpy"}
+        entry[name] = {"text": sympy.sstr(part), "function": source}
+    return entry
+
+
+def derivative_expression(parameter_name, solution_sources, vars_names):
+    parameter = sympy.Symbol(parameter_name)
+    vars_symbols = [sympy.Symbol(name, real=True) for name in vars_names]
+    entries = []
+    for source in solution_sources:
+        try:
+            entries.append(
+                derivative_entry(sympy.sympify(source), parameter, vars_symbols)
+            )
+        except Exception as e:
+            entries.append({"numeric": str(e)})
+    return {"derivatives": entries}
+
+
+def solver_worker(connection):
+    sympy.symbols("x,y")  # pay the sympy import before the first job
+    while True:
+        try:
+            message = connection.recv()
+        except (EOFError, OSError):
+            return
+        if message is None:
+            return
+        job_id, raw_string, vars_names, mode, payload = message
+        try:
+            if mode == "derivative":
+                result = derivative_expression(*payload, vars_names)
+            elif mode == "implicit":
+                result = implicit_expression(raw_string, vars_names)
+            else:
+                result = solve_expression(raw_string, vars_names)
+        except Exception as e:
+            result = {"error": str(e)}
+        connection.send((job_id, result))
+
+
+class SolveJob:
+    def __init__(
+        self,
+        pool: "SolverPool",
+        job_id,
+        raw_string,
+        vars_names,
+        timeout,
+        callback,
+        mode="solve",
+        payload=None,
+    ):
+        self.pool = pool
+        self.id = job_id
+        self.raw_string = raw_string
+        self.vars_names = vars_names
+        self.mode = mode
+        self.payload = payload
+        self.timeout = timeout
+        self.callback = callback
+        self.deadline = None
+        self.started = None
+        self.finished = None
+        self.cancelled = False
+        self.result = None
+        self.done = threading.Event()
+
+    def finish(self, result):
+        self.finished = time.perf_counter()
+        self.result = result
+        self.done.set()
+        if self.callback is not None:
+            self.callback()
+
+    def wait(self, timeout=None):
+        self.done.wait(timeout)
+        return self.result
+
+    def cancel(self, kill=True):
+        self.pool.cancel(self, kill)
+
+
+class SolverWorker:
+    def __init__(self, context):
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(
+            target=solver_worker, args=(child_connection,), daemon=True
+        )
+        self.process.start()
+        child_connection.close()
+        self.job: SolveJob = None
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.connection.close()
+
+
+class SolverPool:
+    def __init__(self, workers=SOLVER_WORKERS, timeout=SOLVE_TIMEOUT):
+        self.context = multiprocessing.get_context("spawn")
+        self.workers_count = workers
+        self.timeout = timeout
+        self.workers: list[SolverWorker] = []
+        self.queue: collections.deque[SolveJob] = collections.deque()
+        self.ids = itertools.count()
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.running = False
+
+    def start(self):
+        self.running = True
+        self.workers = [SolverWorker(self.context) for _ in range(self.workers_count)]
+        self.thread = threading.Thread(
+            target=self.dispatch, name="solver dispatch", daemon=True
+        )
+        self.thread.start()
+
+    def submit(
+        self,
+        raw_string,
+        vars_names,
+        timeout=None,
+        callback=None,
+        mode="solve",
+        payload=None,
+    ):
+        with self.lock:
+            if not self.running:
+                self.start()
+            job = SolveJob(
+                self,
+                next(self.ids),
+                raw_string,
+                list(vars_names),
+                self.timeout if timeout is None else timeout,
+                callback,
+                mode,
+                payload,
+            )
+            self.queue.append(job)
+        self.wakeup.set()
+        return job
+
+    def cancel(self, job: SolveJob, kill=True):
+        with self.lock:
+            if job in self.queue:
+                job.cancelled = True
+                self.queue.remove(job)
+                job.finish({"cancelled": True})
+            elif kill:
+                # restarting a spawned worker costs far more than most solves,
+                # a running job left alone finishes and its result is ignored
+                job.cancelled = True
+        self.wakeup.set()
+
+    def restart(self, worker: SolverWorker):
+        worker.kill()
+        self.workers[self.workers.index(worker)] = SolverWorker(self.context)
+
+    def assign_jobs(self):
+        for worker in self.workers:
+            if worker.job is not None or len(self.queue) <= 0:
+                continue
+            job = self.queue.popleft()
+            job.started = time.perf_counter()
+            job.deadline = job.started + job.timeout
+            worker.job = job
+            worker.connection.send(
+                (job.id, job.raw_string, job.vars_names, job.mode, job.payload)
+            )
+
+    def dispatch(self):
+        while self.running:
+            with self.lock:
+                self.assign_jobs()
+                busy = [worker for worker in self.workers if worker.job is not None]
+            if len(busy) <= 0:
+                self.wakeup.wait(0.1)
+                self.wakeup.clear()
+                continue
+            ready = multiprocessing.connection.wait(
+                [worker.connection for worker in busy], SOLVER_POLL
+            )
+            now = time.perf_counter()
+            with self.lock:
+                if not self.running:
+                    return
+                for worker in busy:
+                    job = worker.job
+                    if worker.connection in ready:
+                        try:
+                            job_id, result = worker.connection.recv()
+                        except (EOFError, OSError):
+                            job_id, result = job.id, {"error": "solver crashed"}
+                            self.restart(worker)
+                        worker.job = None
+                        if job_id == job.id:
+                            job.finish(result)
+                    elif job.cancelled:
+                        self.restart(worker)
+                        job.finish({"cancelled": True})
+                    elif now > job.deadline:
+                        self.restart(worker)
+                        job.finish({"error": "solve timed out", "timeout": True})
+
+    def shutdown(self):
+        with self.lock:
+            self.running = False
+            for job in self.queue:
+                job.finish({"cancelled": True})
+            self.queue.clear()
+            for worker in self.workers:
+                if worker.job is not None:
+                    worker.job.finish({"cancelled": True})
+                worker.kill()
+            self.workers = []
+        self.wakeup.set()
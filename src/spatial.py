@@ -0,0 +1,170 @@
+from .common import *
+from .derivative import interpolate_sample, sample_curve
+
+if typing.TYPE_CHECKING:
+    from .bridge import PlotData, UserExpression
+
+
+class SortedAxisIndex:
+    def __init__(self, points, axis, data: "PlotData" = None):
+        # the unfiltered copy keeps the gaps so interpolation never bridges them
+        source = None if data is None else points.copy()
+        points = points[~numpy.isnan(points).any(axis=1)]
+        keys = points[:, axis]
+        if len(keys) > 1 and not numpy.all(keys[1:] >= keys[:-1]):
+            order = numpy.argsort(keys, kind="stable")
+            points = points[order]
+            keys = points[:, axis]
+            source = None
+        self.axis = axis
+        self.points = points
+        self.keys = keys
+        self.data = data
+        self.source = source
+        self.samples = None
+
+    def sample(self):
+        if self.samples is None:
+            source = self.points
+            if self.source is not None:
+                source = self.source[~numpy.isnan(self.source[:, self.axis])]
+            self.samples = sample_curve(source, self.axis, self.data)
+        return self.samples
+
+    def interpolate(self, parameter):
+        if self.source is None:
+            return None, None
+        return interpolate_sample(*self.sample(), parameter)
+
+    def query(self, position, max_distance):
+        low = numpy.searchsorted(self.keys, position[self.axis] - max_distance, "left")
+        high = numpy.searchsorted(
+            self.keys, position[self.axis] + max_distance, "right"
+        )
+        if low >= high:
+            return
+        window = self.points[low:high]
+        dist_sq = numpy.sum((window - position) ** 2, axis=1)
+        idx = numpy.argmin(dist_sq)
+        return window[idx], dist_sq[idx]
+
+
+class GridIndex:
+    def __init__(self, points, cell, view):
+        self.cell = cell
+        self.columns = int(numpy.ceil(view[0] / cell)) + 3
+        rows = int(numpy.ceil(view[1] / cell)) + 3
+        valid = (
+            ~numpy.isnan(points).any(axis=1)
+            & (points[:, 0] >= -cell)
+            & (points[:, 0] <= view[0] + cell)
+            & (points[:, 1] >= -cell)
+            & (points[:, 1] <= view[1] + cell)
+        )
+        points = points[valid]
+        cells = numpy.floor(points / cell).astype(numpy.int64) + 1
+        cells = numpy.clip(cells, 0, (self.columns - 1, rows - 1))
+        keys = cells[:, 1] * self.columns + cells[:, 0]
+        order = numpy.argsort(keys, kind="stable")
+        self.points = points[order]
+        self.keys = keys[order]
+
+    def query(self, position, max_distance):
+        cx, cy = (numpy.floor(numpy.asarray(position) / self.cell) + 1).astype(int)
+        windows = []
+        for row in (cy - 1, cy, cy + 1):
+            low = numpy.searchsorted(self.keys, row * self.columns + cx - 1, "left")
+            high = numpy.searchsorted(self.keys, row * self.columns + cx + 1, "right")
+            if low < high:
+                windows.append(self.points[low:high])
+        if len(windows) <= 0:
+            return
+        window = numpy.concatenate(windows)
+        dist_sq = numpy.sum((window - position) ** 2, axis=1)
+        idx = numpy.argmin(dist_sq)
+        return window[idx], dist_sq[idx]
+
+
+class PlotIndex:
+    def __init__(self, version=0):
+        self.entries: list[
+            tuple["UserExpression", int, SortedAxisIndex | GridIndex]
+        ] = []
+        self.axes: dict[tuple["UserExpression", int], SortedAxisIndex] = {}
+        self.sources: dict["UserExpression", tuple] = {}
+        self.version = version
+
+    def build(self, expressions: list["UserExpression"], view, previous=None):
+        self.entries = []
+        self.axes = {}
+        self.sources = {}
+        for expression in expressions:
+            if expression.should_skip:
+                continue
+            self.sources[expression] = expression.sampled
+            if previous is not None and previous.reuse(self, expression):
+                continue
+            axis = 1 if expression.kind == "y" else 0
+            if expression.kind == "implicit":
+                axis = None
+            for branch, points in enumerate(expression.plots):
+                if len(points) <= 0:
+                    continue
+                self.add(expression, branch, points, view, axis, expression.plot_data)
+
+    def reuse(self, index: "PlotIndex", expression: "UserExpression"):
+        # the entries hold copies, so kept samples keep their index too
+        if self.sources.get(expression) is not expression.sampled:
+            return False
+        for entry in self.entries:
+            if entry[0] is expression:
+                index.entries.append(entry)
+                if (expression, entry[1]) in self.axes:
+                    index.axes[(expression, entry[1])] = entry[2]
+        return True
+
+    def add(
+        self,
+        expression: "UserExpression",
+        branch,
+        points,
+        view,
+        axis=None,
+        data: "PlotData" = None,
+    ):
+        if axis is None:
+            index = GridIndex(points, HOVER_MAX_DIST, view)
+        else:
+            index = SortedAxisIndex(points, axis, data)
+            self.axes[(expression, branch)] = index
+        self.entries.append((expression, branch, index))
+
+    def query(self, position, max_distance=HOVER_MAX_DIST):
+        position = numpy.asarray(position, dtype=numpy.float64)
+        best = None
+        best_dist = max_distance**2
+        for expression, branch, index in self.entries:
+            hit = index.query(position, max_distance)
+            if hit is None:
+                continue
+            point, dist_sq = hit
+            if dist_sq <= best_dist:
+                best = (point, expression, branch)
+                best_dist = dist_sq
+        return best
+
+
+class HoverCache:
+    def __init__(self):
+        self.key = None
+        self.results = {}
+
+    def lookup(self, key, name, compute, source=None):
+        if key != self.key:
+            self.key = key
+            self.results = {}
+        entry = self.results.get(name)
+        if entry is None or entry[0] is not source:
+            entry = (source, compute())
+            self.results[name] = entry
+        return entry[1]
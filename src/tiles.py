@@ -0,0 +1,109 @@
+from .common import *
+from .sampling import evaluate
+import collections
+import threading
+
+if typing.TYPE_CHECKING:
+    from .bridge import PlotData
+
+
+class TileCache:
+    def __init__(self, max_bytes=TILE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.tiles: collections.OrderedDict[tuple, tuple] = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        if total == 0:
+            return 0
+        return self.hits / total
+
+    def level(self, czoom):
+        return int(numpy.floor(numpy.log2(czoom)))
+
+    def sample(self, function, data: "PlotData", pixels, inputs):
+        level = self.level(data.czoom)
+        tile_width = TILE_PIXELS / (data.unit * 2.0**level)
+        precision = abs((data.stop - data.start) / data.step)
+        samples = max(int(numpy.ceil(precision * TILE_PIXELS / max(pixels, 1))), 2)
+        low, high = sorted((data.start, data.stop))
+        first = int(numpy.floor(low / tile_width))
+        last = int(numpy.floor(high / tile_width))
+        base_key = (function, inputs, level, samples, data.dtype)
+
+        tiles = {}
+        missing = []
+        with self.lock:
+            for index in range(first, last + 1):
+                tile = self.tiles.get(base_key + (index,))
+                # a tile sampled sparser than this pass asks for is refined in place
+                if tile is None or tile[2] > data.stride:
+                    missing.append((index, tile))
+                    self.misses += 1
+                    continue
+                # finer tiles are served as they are, only new ones start coarse
+                self.tiles.move_to_end(base_key + (index,))
+                tiles[index] = tile
+                self.hits += 1
+        if len(missing) > 0:
+            offsets = numpy.arange(0, samples, data.stride) * (tile_width / samples)
+            positions = []
+            for index, tile in missing:
+                xs = (index * tile_width + offsets).astype(data.dtype, copy=False)
+                fresh = numpy.ones(len(xs), bool)
+                if tile is not None:
+                    fresh[:: tile[2] // data.stride] = False
+                positions.append((xs, fresh))
+            ys = evaluate(
+                function,
+                numpy.concatenate([xs[fresh] for xs, fresh in positions]),
+                data.variables,
+            )
+            offset = 0
+            for (index, tile), (xs, fresh) in zip(missing, positions):
+                values = numpy.empty(len(xs), ys.dtype)
+                count = numpy.count_nonzero(fresh)
+                values[fresh] = ys[offset : offset + count]
+                offset += count
+                if tile is not None:
+                    values[~fresh] = tile[1]
+                tile = (xs, values, data.stride)
+                tiles[index] = tile
+                self.put(base_key + (index,), tile)
+
+        ordered = [tiles[index] for index in range(first, last + 1)]
+        xs = numpy.concatenate([tile[0] for tile in ordered])
+        ys = numpy.concatenate([tile[1] for tile in ordered])
+        stride = max(tile[2] for tile in ordered)
+        if data.start > data.stop:
+            return xs[::-1], ys[::-1], stride
+        return xs, ys, stride
+
+    def put(self, key, tile):
+        size = tile[0].nbytes + tile[1].nbytes
+        with self.lock:
+            if key in self.tiles:
+                old = self.tiles.pop(key)
+                self.bytes -= old[0].nbytes + old[1].nbytes
+            self.tiles[key] = tile
+            self.bytes += size
+            while self.bytes > self.max_bytes and len(self.tiles) > 1:
+                _, old = self.tiles.popitem(last=False)
+                self.bytes -= old[0].nbytes + old[1].nbytes
+
+    def discard(self, functions):
+        functions = set(functions)
+        with self.lock:
+            for key in [key for key in self.tiles if key[0] in functions]:
+                old = self.tiles.pop(key)
+                self.bytes -= old[0].nbytes + old[1].nbytes
+
+    def clear(self):
+        with self.lock:
+            self.tiles.clear()
+            self.bytes = 0